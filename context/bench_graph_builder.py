@@ -0,0 +1,106 @@
+# context/bench_graph_builder.py
+# Timing comparison for street-vertex welding on a synthetic street layer.
+# Usage: python bench_graph_builder.py [n_vertices]   (default 50000)
+
+import sys
+import time
+import random
+
+from graph_builder import WeldGrid, TOLERANCE_M, build_graph
+
+try:
+    from scipy.spatial import cKDTree
+except Exception:
+    cKDTree = None
+
+
+def synthetic_streets(n_vertices: int, seed: int = 7):
+    """
+    Random polylines on a 2 km square with ~10% of vertices duplicated within
+    the weld tolerance (shared intersections), as a GeoJSON FeatureCollection.
+    """
+    rnd = random.Random(seed)
+    feats, placed, count = [], [], 0
+    while count < n_vertices:
+        n = min(rnd.randint(2, 12), n_vertices - count)
+        if n < 2:
+            break
+        coords = []
+        for _ in range(n):
+            if placed and rnd.random() < 0.1:
+                px, py = rnd.choice(placed)
+                x, y = px + rnd.uniform(-0.3, 0.3), py + rnd.uniform(-0.3, 0.3)
+            else:
+                x, y = rnd.uniform(-1000.0, 1000.0), rnd.uniform(-1000.0, 1000.0)
+            coords.append([x, y])
+            placed.append((x, y))
+        count += n
+        feats.append({"type": "Feature", "properties": {},
+                      "geometry": {"type": "LineString", "coordinates": coords}})
+    return {"type": "FeatureCollection", "features": feats}
+
+
+def _iter_vertices(streets_json):
+    for feat in streets_json["features"]:
+        for x, y in feat["geometry"]["coordinates"]:
+            yield float(x), float(y)
+
+
+def weld_rebuild_kdtree(streets_json):
+    """Previous behaviour: rebuild a cKDTree after every new vertex."""
+    coords, ids, kdt = [], [], None
+    for x, y in _iter_vertices(streets_json):
+        if kdt is not None:
+            dist, idx = kdt.query([x, y], k=1)
+            if dist < TOLERANCE_M:
+                continue
+        ids.append("street_v{}".format(len(ids)))
+        coords.append((x, y))
+        kdt = cKDTree(coords)
+    return dict(zip(ids, coords))
+
+
+def weld_grid(streets_json):
+    grid, out = WeldGrid(TOLERANCE_M), {}
+    for x, y in _iter_vertices(streets_json):
+        nid, dist = grid.nearest(x, y)
+        if dist < TOLERANCE_M:
+            continue
+        nid = "street_v{}".format(len(out))
+        grid.insert(x, y, nid)
+        out[nid] = (x, y)
+    return out
+
+
+def main():
+    n_vertices = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    streets = synthetic_streets(n_vertices)
+    print("[bench] synthetic street layer: {} vertices, {} features".format(
+        n_vertices, len(streets["features"])), flush=True)
+
+    t0 = time.perf_counter()
+    grid_nodes = weld_grid(streets)
+    t_grid = time.perf_counter() - t0
+    print("[bench] hash grid      : {:8.3f} s  ({} nodes)".format(t_grid, len(grid_nodes)), flush=True)
+
+    if cKDTree is None:
+        print("[bench] SciPy not available; skipping bulk mode and cKDTree rebuild baseline.")
+        return
+
+    for mode in ("incremental", "bulk"):
+        t0 = time.perf_counter()
+        G = build_graph(streets, None, None, snap_mode=mode)
+        print("[bench] build_graph {:<11}: {:8.3f} s  ({} nodes)".format(
+            mode, time.perf_counter() - t0, G.number_of_nodes()), flush=True)
+
+    t0 = time.perf_counter()
+    kdt_nodes = weld_rebuild_kdtree(streets)
+    t_kdt = time.perf_counter() - t0
+    print("[bench] kdtree rebuild : {:8.3f} s  ({} nodes)".format(t_kdt, len(kdt_nodes)), flush=True)
+
+    same = grid_nodes == kdt_nodes
+    print("[bench] speedup x{:.1f}, identical node set: {}".format(t_kdt / max(t_grid, 1e-9), same))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+# geojson_stream.py - incremental GeoJSON feature reader (Python 3 and IronPython 2.7)
+# Yields one feature at a time from a FeatureCollection without loading the whole file,
+# so memory stays bounded by the largest single feature plus one read chunk.
+
+import io
+import re
+import json
+
+CHUNK_SIZE = 1 << 16  # characters per read
+
+_FEATURES_RX = re.compile(r'"features"\s*:\s*\[')
+_WS_COMMA = " \t\r\n,"
+
+
+def iter_geojson_features(path, chunk_size=CHUNK_SIZE):
+    """
+    Iterate the 'features' array of a GeoJSON FeatureCollection one feature at a time.
+    Raises ValueError if the file is truncated or not a FeatureCollection.
+    """
+    decoder = json.JSONDecoder()
+    with io.open(path, "r", encoding="utf-8-sig", errors="replace") as f:
+        # 1) Scan forward to the opening bracket of the features array
+        buf = u""
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                raise ValueError("No 'features' array in {0}".format(path))
+            buf += chunk
+            m = _FEATURES_RX.search(buf)
+            if m:
+                buf = buf[m.end():]
+                break
+            buf = buf[-64:]  # keep a tail in case the key straddles two chunks
+
+        # 2) Decode features in place; trim the buffer only when refilling
+        pos = 0
+        eof = False
+        while True:
+            while pos < len(buf) and buf[pos] in _WS_COMMA:
+                pos += 1
+            if pos < len(buf):
+                if buf[pos] == "]":
+                    return
+                try:
+                    feat, end = decoder.raw_decode(buf, pos)
+                except ValueError:
+                    if eof:
+                        raise
+                else:
+                    pos = end
+                    yield feat
+                    continue
+            elif eof:
+                raise ValueError("Unexpected end of features array in {0}".format(path))
+
+            # Grow reads geometrically so very large features decode in O(n)
+            chunk = f.read(max(chunk_size, len(buf) - pos))
+            if not chunk:
+                eof = True
+            buf = buf[pos:] + chunk
+            pos = 0
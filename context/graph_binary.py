@@ -0,0 +1,308 @@
+# graph_binary.py - versioned binary companion for graph.json / graph_context.json
+# Pure stdlib (struct + array) so it loads in Python 3 and in Rhino's IronPython 2.7;
+# Python 3 readers with NumPy can map the numeric sections without copying.
+#
+# Layout (little-endian, every section padded to 8 bytes):
+#   header   "<4sHHIII": magic b"UGB1", version, flags, n_nodes, n_edges, n_line_pts
+#   x, y        float64[n]        node coordinates (NaN = missing)
+#   node_type   int16[n]          code into the node type table (-1 = none)
+#   eu, ev      int32[m]          edge endpoints (node indices)
+#   edge_type   int16[m]          code into the edge type table (-1 = none)
+#   distance    float64[m]        (NaN = missing)
+#   line_off    int32[m+1]        edge i line = line_xy[line_off[i]:line_off[i+1]] points
+#   line_xy     float64[2*L]
+#   string tables: node ids, node type names, edge type names, node props, edge props
+#                  each: count int32, off int32[count+1], utf-8 bytes
+#   props entries are small JSON objects ("" = no extra attributes), decoded on access.
+
+import io
+import os
+import sys
+import json
+import math
+import struct
+from array import array
+
+MAGIC = b"UGB1"
+VERSION = 1
+EXT = ".ugb"
+_HEADER = struct.Struct("<4sHHIII")
+_BIG_ENDIAN = sys.byteorder == "big"
+
+_NODE_KEYS = ("id", "x", "y", "type")
+_EDGE_KEYS = ("u", "v", "type", "distance", "line")
+
+
+def binary_path_for(json_path):
+    """graph.json -> graph.ugb (same folder)."""
+    return os.path.splitext(json_path)[0] + EXT
+
+
+def _pad(n):
+    return (-n) % 8
+
+
+def _arr(typecode, values):
+    a = array(typecode, values)
+    if _BIG_ENDIAN:
+        a.byteswap()
+    return a
+
+
+def _arr_bytes(a):
+    try:
+        return a.tobytes()
+    except AttributeError:  # IronPython 2.7
+        return a.tostring()
+
+
+def _str_table(strings):
+    blobs = [s.encode("utf-8") for s in strings]
+    off = [0]
+    for b in blobs:
+        off.append(off[-1] + len(b))
+    return [_arr("i", [len(blobs)]), _arr("i", off), b"".join(blobs)]
+
+
+def _nan(v):
+    return float("nan") if v is None else float(v)
+
+
+# ---------------- Writer ----------------
+def write_graph_binary(data, path):
+    """Write a {"nodes", "edges"} graph dict (graph_builder schema) atomically. Python 3 only."""
+    nodes = data.get("nodes", []) or []
+    edges = data.get("edges", []) or []
+    index = {}
+    for i, n in enumerate(nodes):
+        index[n.get("id")] = i
+
+    ntypes, etypes = [], []
+
+    def code(table, name):
+        if name is None:
+            return -1
+        if name not in table:
+            table.append(name)
+        return table.index(name)
+
+    xs, ys, ntc, nprops = [], [], [], []
+    for n in nodes:
+        xs.append(_nan(n.get("x")))
+        ys.append(_nan(n.get("y")))
+        ntc.append(code(ntypes, n.get("type")))
+        extra = dict((k, v) for k, v in n.items() if k not in _NODE_KEYS)
+        nprops.append(json.dumps(extra, ensure_ascii=False) if extra else "")
+
+    eu, ev, etc, dist, line_off, line_xy, eprops = [], [], [], [], [0], [], []
+    for e in edges:
+        eu.append(index[e["u"]])
+        ev.append(index[e["v"]])
+        etc.append(code(etypes, e.get("type")))
+        dist.append(_nan(e.get("distance")))
+        for pt in (e.get("line") or []):
+            line_xy.append(float(pt[0]))
+            line_xy.append(float(pt[1]))
+        line_off.append(len(line_xy) // 2)
+        extra = dict((k, v) for k, v in e.items() if k not in _EDGE_KEYS)
+        eprops.append(json.dumps(extra, ensure_ascii=False) if extra else "")
+
+    sections = [
+        _HEADER.pack(MAGIC, VERSION, 0, len(nodes), len(edges), line_off[-1]),
+        _arr("d", xs), _arr("d", ys), _arr("h", ntc),
+        _arr("i", eu), _arr("i", ev), _arr("h", etc), _arr("d", dist),
+        _arr("i", line_off), _arr("d", line_xy),
+    ]
+    for table in ([str(n.get("id")) for n in nodes], ntypes, etypes, nprops, eprops):
+        sections.append(_str_table(table))
+
+    tmp = path + ".tmp"
+    with io.open(tmp, "wb") as f:
+        def emit(chunk):
+            b = chunk if isinstance(chunk, bytes) else _arr_bytes(chunk)
+            f.write(b)
+            f.write(b"\0" * _pad(len(b)))
+        for sec in sections:
+            if isinstance(sec, list):  # string table: count, offsets, blob
+                for part in sec:
+                    emit(part)
+            else:
+                emit(sec)
+    os.replace(tmp, path)
+
+
+# ---------------- Readers ----------------
+class _Cursor(object):
+    def __init__(self, buf):
+        self.buf = buf
+        self.pos = 0
+
+    def take(self, nbytes):
+        start = self.pos
+        self.pos += nbytes + _pad(nbytes)
+        return start, nbytes
+
+    def array(self, typecode, count):
+        start, nbytes = self.take(count * array(typecode).itemsize)
+        a = array(typecode)
+        chunk = bytes(self.buf[start:start + nbytes])
+        try:
+            a.frombytes(chunk)
+        except AttributeError:  # IronPython 2.7
+            a.fromstring(chunk)
+        if _BIG_ENDIAN:
+            a.byteswap()
+        return a
+
+    def strings(self):
+        count = self.array("i", 1)[0]
+        off = self.array("i", count + 1)
+        start, nbytes = self.take(off[-1])
+        blob = bytes(self.buf[start:start + nbytes])
+        text = blob.decode("utf-8")
+        if len(text) == len(blob):  # ASCII: byte offsets are character offsets
+            return [text[off[i]:off[i + 1]] for i in range(count)]
+        return [blob[off[i]:off[i + 1]].decode("utf-8") for i in range(count)]
+
+
+def decode_props(entries):
+    """Decode a props table ("" = no extras) with one json.loads call instead of one per entry."""
+    if not any(entries):
+        return [None] * len(entries)
+    return json.loads("[" + ",".join([p or "null" for p in entries]) + "]")
+
+
+class LazyProps(object):
+    """Read-only sequence over a props table that decodes an entry on first access."""
+
+    def __init__(self, entries):
+        self._raw = entries
+        self._cache = {}
+
+    def __len__(self):
+        return len(self._raw)
+
+    def __getitem__(self, i):
+        d = self._cache.get(i)
+        if d is None:
+            raw = self._raw[i]
+            d = self._cache[i] = json.loads(raw) if raw else {}
+        return d
+
+
+def _read_header(buf, path):
+    magic, version, _flags, n, m, npts = _HEADER.unpack_from(buf, 0)
+    if magic != MAGIC:
+        raise ValueError("Not a graph binary: {0}".format(path))
+    if version > VERSION:
+        raise ValueError("Unsupported graph binary version {0}: {1}".format(version, path))
+    return n, m, npts
+
+
+def _read_file(path):
+    with io.open(path, "rb") as f:
+        return f.read()
+
+
+def read_graph_binary(path):
+    """Load a .ugb file as the same {"nodes": [...], "edges": [...]} dict as the JSON."""
+    buf = _read_file(path)
+    n, m, npts = _read_header(buf, path)
+    cur = _Cursor(buf)
+    cur.take(_HEADER.size)
+    xs, ys, ntc = cur.array("d", n), cur.array("d", n), cur.array("h", n)
+    eu, ev, etc, dist = cur.array("i", m), cur.array("i", m), cur.array("h", m), cur.array("d", m)
+    line_off, line_xy = cur.array("i", m + 1), cur.array("d", 2 * npts)
+    ids, ntypes, etypes, nprops, eprops = (cur.strings() for _ in range(5))
+
+    nprops, eprops = decode_props(nprops), decode_props(eprops)
+    nan = math.isnan
+    nodes = []
+    for i in range(n):
+        d = {"id": ids[i]}
+        x, y, t = xs[i], ys[i], ntc[i]
+        if not nan(x):
+            d["x"] = x
+        if not nan(y):
+            d["y"] = y
+        d["type"] = ntypes[t] if t >= 0 else None
+        if nprops[i]:
+            d.update(nprops[i])
+        nodes.append(d)
+
+    pts = [[line_xy[j], line_xy[j + 1]] for j in range(0, 2 * npts, 2)]
+    edges = []
+    for k in range(m):
+        t, dk = etc[k], dist[k]
+        e = {
+            "u": ids[eu[k]], "v": ids[ev[k]],
+            "type": etypes[t] if t >= 0 else None,
+            "distance": None if nan(dk) else dk,
+            "line": pts[line_off[k]:line_off[k + 1]],
+        }
+        if eprops[k]:
+            e.update(eprops[k])
+        edges.append(e)
+    return {"nodes": nodes, "edges": edges}
+
+
+def map_graph_binary(path):
+    """
+    Python 3 + NumPy: the numeric sections of a .ugb file as NumPy arrays (copied out
+    of a memory map, which is closed again so the file is never left locked) plus
+    the string tables; props entries stay undecoded JSON strings.
+    """
+    import mmap
+    import numpy as np
+
+    with io.open(path, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        n, m, npts = _read_header(mm, path)
+        cur = _Cursor(mm)
+        cur.take(_HEADER.size)
+
+        def array(dtype, count):
+            dt = np.dtype(dtype)
+            start, _ = cur.take(count * dt.itemsize)
+            return np.frombuffer(mm, dtype=dt, count=count, offset=start).astype(dt.newbyteorder("="))
+
+        out = {
+            "x": array("<f8", n), "y": array("<f8", n), "node_type": array("<i2", n),
+            "eu": array("<i4", m), "ev": array("<i4", m), "edge_type": array("<i2", m),
+            "distance": array("<f8", m), "line_off": array("<i4", m + 1),
+            "line_xy": array("<f8", 2 * npts).reshape(-1, 2),
+        }
+        for key in ("ids", "node_type_names", "edge_type_names", "node_props", "edge_props"):
+            out[key] = cur.strings()
+    finally:
+        mm.close()
+    return out
+
+
+def fresh_binary_path(json_path):
+    """
+    Binary companion of json_path if both exist and the binary is at least as new as the
+    JSON, else None. A .ugb whose JSON is gone is stale (e.g. left behind by a cleanup).
+    """
+    bin_path = binary_path_for(json_path)
+    try:
+        if not os.path.exists(json_path) or not os.path.exists(bin_path):
+            return None
+        if os.path.getmtime(bin_path) < os.path.getmtime(json_path):
+            return None
+        return bin_path
+    except Exception:
+        return None
+
+
+def load_graph(json_path):
+    """Load a graph dict, preferring a fresh binary companion; falls back to JSON."""
+    bin_path = fresh_binary_path(json_path)
+    if bin_path:
+        try:
+            return read_graph_binary(bin_path)
+        except Exception:
+            pass
+    with io.open(json_path, "r", encoding="utf-8") as f:
+        return json.load(f)
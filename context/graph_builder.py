@@ -1,36 +1,70 @@
 # context/graph_builder.py
-# Build an urban graph from OSM GeoJSON outputs and write both a raw and a simplified graph.
+# Build an urban graph from OSM layer outputs (GeoParquet / FlatGeobuf / GeoJSON)
+# and write both a raw and a simplified graph.
 
 import os
 import sys
 import json
 import math
 import time
-from typing import List, Tuple, Dict, Any
+import shutil
+import hashlib
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple, Dict, Any, Iterable, Union
 
 import networkx as nx
+import numpy as np
+import shapely
 from shapely.geometry import shape
 
+from geojson_stream import iter_geojson_features
+from graph_binary import write_graph_binary, binary_path_for
+from job_metrics import JobMetrics, NO_METRICS
+from urban_graph import UrbanGraph
+
 # Optional SciPy KDTree; fall back to linear scan if unavailable
 try:
     from scipy.spatial import cKDTree
 except Exception:
     cKDTree = None
 
-TOLERANCE_M = 1.0  # merge tolerance for street vertices (meters)
-
+try:
+    import geopandas as gpd  # only needed to read columnar (.parquet / .fgb) layers
+except Exception:
+    gpd = None
 
-def load_geojson(path: str) -> Dict[str, Any]:
-    try:
-        with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except UnicodeDecodeError:
-        try:
-            with open(path, "r", encoding="utf-8-sig") as f:
-                return json.load(f)
-        except UnicodeDecodeError:
-            with open(path, "r", encoding="utf-8", errors="replace") as f:
-                return json.load(f)
+TOLERANCE_M = 1.0  # merge tolerance for street vertices (meters)
+SNAP_MODE = os.environ.get("SNAP_MODE", "incremental")  # "incremental" | "bulk"
+ATTACH_MODE = os.environ.get("ATTACH_MODE", "vertex")    # "vertex" | "segment"
+POI_BATCH = 8192   # features per vectorized POI batch (bounds memory when streaming)
+TILE_M = float(os.environ.get("TILE_M", "0"))              # > 0: tiled multi-process build, tile edge (m)
+BUILD_WORKERS = int(os.environ.get("BUILD_WORKERS", "0"))  # 0 -> os.cpu_count()
+# Bump whenever graph.json / graph_context.json output changes for the same inputs
+BUILDER_VERSION = "2"
+GRAPH_CACHE_DIR = os.environ.get(
+    "GRAPH_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "cache", "graph"))
+GRAPH_CACHE = os.environ.get("GRAPH_CACHE", "1") != "0"   # "0" disables the build cache
+GRAPH_CACHE_MAX = int(os.environ.get("GRAPH_CACHE_MAX", "32"))  # entries kept (oldest pruned)
+LAYER_NAMES = ("streets", "buildings", "greens")
+# Reader preference: columnar layers first, GeoJSON (Rhino importer export) last
+LAYER_EXTS = (".parquet", ".fgb", ".geojson")
+
+# Shapely 2 array API + SciPy enable the batched POI path
+_VECTOR_POIS = cKDTree is not None and hasattr(shapely, "from_geojson")
+
+
+# A FeatureCollection dict or any iterable of features (e.g. iter_geojson_features)
+FeatureSource = Union[Dict[str, Any], Iterable[Dict[str, Any]], None]
+
+
+def iter_features(src: FeatureSource) -> Iterable[Dict[str, Any]]:
+    if not src:
+        return []
+    if isinstance(src, dict):
+        return src.get("features", []) or []
+    return src
 
 
 def line_coords_from_feature(geom: Dict[str, Any]) -> List[List[Tuple[float, float]]]:
@@ -42,47 +76,53 @@ def line_coords_from_feature(geom: Dict[str, Any]) -> List[List[Tuple[float, flo
     return []
 
 
-def build_graph(streets_json: Dict, buildings_json: Dict, greens_json: Dict) -> nx.Graph:
-    G = nx.Graph()
+class WeldGrid:
+    """
+    Uniform hash grid for incremental street-vertex welding.
+    Cell size equals the weld tolerance, so any vertex closer than the tolerance
+    lies in the 3x3 block around the query cell: lookups and inserts are O(1).
+    """
 
-    # ---- 1) Streets: create/merge vertices and edges ----
-    coord_list: List[Tuple[float, float]] = []
-    id_list: List[str] = []
-    kdt = None
-    vcount = 0
+    def __init__(self, cell: float = TOLERANCE_M):
+        self.cell = float(cell) if cell and cell > 0 else 1.0
+        self.cells: Dict[Tuple[int, int], List[Tuple[float, float, Any]]] = {}
 
-    def _rebuild_kdt():
-        nonlocal kdt
-        if cKDTree and coord_list:
-            kdt = cKDTree(coord_list)
-
-    def _nearest_existing(x: float, y: float):
-        if not coord_list:
-            return None, float("inf")
-        if cKDTree and kdt is not None:
-            dist, idx = kdt.query([x, y], k=1)
-            return id_list[int(idx)], float(dist)
+    def _key(self, x: float, y: float) -> Tuple[int, int]:
+        return (int(math.floor(x / self.cell)), int(math.floor(y / self.cell)))
+
+    def insert(self, x: float, y: float, nid: Any):
+        self.cells.setdefault(self._key(x, y), []).append((x, y, nid))
+
+    def nearest(self, x: float, y: float):
+        """Nearest vertex within one cell of (x, y); (None, inf) if none."""
+        i, j = self._key(x, y)
         best_id, best_d2 = None, float("inf")
-        for nid, (cx, cy) in zip(id_list, coord_list):
-            d2 = (cx - x) * (cx - x) + (cy - y) * (cy - y)
-            if d2 < best_d2:
-                best_d2, best_id = d2, nid
+        for di in (-1, 0, 1):
+            for dj in (-1, 0, 1):
+                for cx, cy, nid in self.cells.get((i + di, j + dj), ()):
+                    d2 = (cx - x) * (cx - x) + (cy - y) * (cy - y)
+                    if d2 < best_d2:
+                        best_d2, best_id = d2, nid
         return best_id, math.sqrt(best_d2)
 
+
+def _add_streets_incremental(G: nx.Graph, streets_json: FeatureSource):
+    """Per-vertex path: weld each street vertex against the ones already placed."""
+    weld = WeldGrid(TOLERANCE_M)
+    vcount = 0
+
     def get_or_create_vertex(x: float, y: float) -> str:
         nonlocal vcount
-        nid, dist = _nearest_existing(x, y)
+        nid, dist = weld.nearest(x, y)
         if dist < TOLERANCE_M:
             return nid
         node_id = "street_v{}".format(vcount)
         vcount += 1
         G.add_node(node_id, x=float(x), y=float(y), type="street")
-        coord_list.append((float(x), float(y)))
-        id_list.append(node_id)
-        _rebuild_kdt()
+        weld.insert(float(x), float(y), node_id)
         return node_id
 
-    for feat in streets_json.get("features", []):
+    for feat in iter_features(streets_json):
         parts = line_coords_from_feature(feat.get("geometry", {}))
         for coords in parts:
             if len(coords) < 2:
@@ -95,7 +135,275 @@ def build_graph(streets_json: Dict, buildings_json: Dict, greens_json: Dict) ->
                 dist = math.hypot(bx - ax, by - ay)
                 G.add_edge(a, b, type="street", line=[(ax, ay), (bx, by)], distance=dist)
 
-    # ---- 2) POIs: connect centroid to nearest street vertex ----
+
+def _street_coords(streets_json: FeatureSource) -> Tuple[np.ndarray, List[int]]:
+    """Every street coordinate in input order as an (n, 2) array, plus the length of each part."""
+    xs: List[float] = []
+    ys: List[float] = []
+    part_len: List[int] = []
+    for feat in iter_features(streets_json):
+        for coords in line_coords_from_feature(feat.get("geometry", {})):
+            if len(coords) < 2:
+                continue
+            for x, y in coords:
+                xs.append(float(x))
+                ys.append(float(y))
+            part_len.append(len(coords))
+    xy = np.column_stack([np.asarray(xs, dtype=np.float64), np.asarray(ys, dtype=np.float64)])
+    return xy, part_len
+
+
+def _weld_pairs(xy: np.ndarray, pairs: np.ndarray) -> np.ndarray:
+    """
+    Welding by the per-vertex rule from candidate pairs (i < j) of coordinates: a
+    coordinate joins the nearest earlier vertex closer than TOLERANCE_M, else starts
+    a new one. Returns owner[j], the coordinate whose vertex j was welded to.
+    Only coordinates that have an earlier neighbour are visited one by one.
+    """
+    n = len(xy)
+    owner = np.arange(n)
+    if not len(pairs):
+        return owner
+    # Same distance test as WeldGrid (earlier vertex minus new coordinate)
+    dx, dy = xy[pairs[:, 0], 0] - xy[pairs[:, 1], 0], xy[pairs[:, 0], 1] - xy[pairs[:, 1], 1]
+    d = np.sqrt(dx * dx + dy * dy)
+    keep = d < TOLERANCE_M
+    pi, pj, d = pairs[keep, 0], pairs[keep, 1], d[keep]
+    order = np.lexsort((pi, pj))
+    pi, pj, d = pi[order].tolist(), pj[order].tolist(), d[order].tolist()
+
+    is_vertex = [True] * n
+    k, m = 0, len(pj)
+    while k < m:
+        j, best, best_d = pj[k], -1, TOLERANCE_M
+        while k < m and pj[k] == j:
+            i = pi[k]
+            if is_vertex[i] and d[k] < best_d:
+                best, best_d = i, d[k]
+            k += 1
+        if best >= 0:
+            is_vertex[j] = False
+            owner[j] = best
+    return owner
+
+
+def _emit_streets(G: nx.Graph, xy: np.ndarray, part_len: List[int], owner: np.ndarray):
+    """Add street vertices (numbered by first occurrence) and the edges of every part to G."""
+    n = len(xy)
+    rep = np.nonzero(owner == np.arange(n))[0]  # vertex-starting coordinates, in order
+    rank = np.empty(n, dtype=np.int64)
+    rank[rep] = np.arange(len(rep))
+    vid_of = rank[owner]
+
+    node_ids = ["street_v{}".format(i) for i in range(len(rep))]
+    rx, ry = xy[rep, 0].tolist(), xy[rep, 1].tolist()
+    G.add_nodes_from(
+        (nid, {"x": x, "y": y, "type": "street"}) for nid, x, y in zip(node_ids, rx, ry)
+    )
+
+    # Consecutive vertices within the same part become edges
+    part_id = np.repeat(np.arange(len(part_len)), part_len)
+    seg = np.nonzero(part_id[:-1] == part_id[1:])[0]
+    ea, eb = vid_of[seg].tolist(), vid_of[seg + 1].tolist()
+    G.add_edges_from(
+        (node_ids[a], node_ids[b],
+         {"type": "street", "line": [(rx[a], ry[a]), (rx[b], ry[b])],
+          "distance": math.hypot(rx[b] - rx[a], ry[b] - ry[a])})  # math.hypot: bit-equal to incremental
+        for a, b in zip(ea, eb)
+    )
+
+
+# Candidate radius for pair queries: a hair above the tolerance, the exact test is in _weld_pairs
+_PAIR_R = TOLERANCE_M * (1.0 + 1e-9)
+
+
+def _add_streets_bulk(G: nx.Graph, streets_json: FeatureSource):
+    """
+    Bulk path: gather every street coordinate, find all pairs closer than TOLERANCE_M
+    with one cKDTree query and emit nodes/edges from index arrays. The graph is
+    identical to the incremental path.
+    """
+    xy, part_len = _street_coords(streets_json)
+    if not len(xy):
+        return
+    pairs = cKDTree(xy).query_pairs(r=_PAIR_R, output_type="ndarray")
+    _emit_streets(G, xy, part_len, _weld_pairs(xy, pairs))
+
+
+class SegmentSnapper:
+    """
+    Attach POIs to the nearest street *segment* (STRtree over street edges).
+    Each batch of POIs is projected in bulk; every hit segment is split once at
+    all its projections (sorted along the segment), so access edges end on a new
+    street vertex at the foot of the perpendicular. Projections closer than
+    TOLERANCE_M to an endpoint or to each other share that vertex.
+    """
+
+    def __init__(self, G: nx.Graph):
+        self.G = G
+        self.seg_u: List[str] = []
+        self.seg_v: List[str] = []
+        self.seg_a: List[Tuple[float, float]] = []
+        self.seg_b: List[Tuple[float, float]] = []
+        for u, v, d in G.edges(data=True):
+            if d.get("type") == "street":
+                self._append(u, v)
+        self.vcount = sum(1 for _, d in G.nodes(data=True) if d.get("type") == "street")
+
+    def _xy(self, n: str) -> Tuple[float, float]:
+        d = self.G.nodes[n]
+        return (d["x"], d["y"])
+
+    def _append(self, u: str, v: str):
+        self.seg_u.append(u)
+        self.seg_v.append(v)
+        self.seg_a.append(self._xy(u))
+        self.seg_b.append(self._xy(v))
+
+    def _new_vertex(self, x: float, y: float) -> str:
+        while "street_v{}".format(self.vcount) in self.G:
+            self.vcount += 1
+        node_id = "street_v{}".format(self.vcount)
+        self.vcount += 1
+        self.G.add_node(node_id, x=x, y=y, type="street")
+        return node_id
+
+    def _add_street_edge(self, a: str, b: str):
+        (ax, ay), (bx, by) = self._xy(a), self._xy(b)
+        self.G.add_edge(a, b, type="street", line=[(ax, ay), (bx, by)], distance=math.hypot(bx - ax, by - ay))
+
+    def attach(self, node_ids: List[str], xs: np.ndarray, ys: np.ndarray):
+        if not self.seg_u or not node_ids:
+            return
+        A = np.asarray(self.seg_a, dtype=np.float64)
+        B = np.asarray(self.seg_b, dtype=np.float64)
+        lines = shapely.linestrings(np.stack([A, B], axis=1))
+        pts = shapely.points(xs, ys)
+        hit = shapely.STRtree(lines).query_nearest(pts, all_matches=False)
+        seg_of = np.empty(len(node_ids), dtype=np.int64)
+        seg_of[hit[0]] = hit[1]
+
+        # Projection parameter along each segment and the projected point
+        seg_len = np.hypot(*(B[seg_of] - A[seg_of]).T)
+        t = shapely.line_locate_point(lines[seg_of], pts)
+        frac = np.divide(t, seg_len, out=np.zeros_like(t), where=seg_len > 0)
+        px = A[seg_of, 0] + (B[seg_of, 0] - A[seg_of, 0]) * frac
+        py = A[seg_of, 1] + (B[seg_of, 1] - A[seg_of, 1]) * frac
+
+        order = np.lexsort((t, seg_of)).tolist()
+        seg_l, t_l, len_l = seg_of.tolist(), t.tolist(), seg_len.tolist()
+        px_l, py_l, xs_l, ys_l = px.tolist(), py.tolist(), xs.tolist(), ys.tolist()
+
+        access = []
+        i = 0
+        while i < len(order):
+            k = seg_l[order[i]]
+            u, v = self.seg_u[k], self.seg_v[k]
+            cuts: List[Tuple[float, str]] = []
+            while i < len(order) and seg_l[order[i]] == k:
+                p = order[i]
+                tp = t_l[p]
+                if tp < TOLERANCE_M:
+                    vid = u
+                elif len_l[p] - tp < TOLERANCE_M:
+                    vid = v
+                elif cuts and tp - cuts[-1][0] < TOLERANCE_M:
+                    vid = cuts[-1][1]
+                else:
+                    vid = self._new_vertex(px_l[p], py_l[p])
+                    cuts.append((tp, vid))
+                access.append((node_ids[p], vid, xs_l[p], ys_l[p]))
+                i += 1
+            if cuts:
+                # Split u-v once through all cut vertices
+                self.G.remove_edge(u, v)
+                chain = [u] + [c[1] for c in cuts] + [v]
+                for a, b in zip(chain[:-1], chain[1:]):
+                    self._add_street_edge(a, b)
+                self.seg_v[k], self.seg_b[k] = chain[1], self._xy(chain[1])
+                for a, b in zip(chain[1:-1], chain[2:]):
+                    self._append(a, b)
+
+        for nid, vid, x, y in access:
+            sx, sy = self._xy(vid)
+            self.G.add_edge(nid, vid, type="access", line=[(x, y), (sx, sy)],
+                            distance=math.hypot(sx - x, sy - y))
+
+
+def parse_poi_batch(feats: List[Dict]) -> Tuple[List[Dict], np.ndarray, np.ndarray]:
+    """
+    Parse a batch of POI features -> (props, cx, cy) of valid ones. Points (most POIs) are
+    their own centroid and are read straight from their coordinates; only other geometry
+    types go through GeoJSON parsing and the Shapely 2 array API.
+    """
+    cx = np.full(len(feats), np.nan)
+    cy = np.full(len(feats), np.nan)
+    other = []
+    for i, f in enumerate(feats):
+        g = f.get("geometry") or {}
+        c = g.get("coordinates")
+        if g.get("type") == "Point" and isinstance(c, (list, tuple)) and len(c) >= 2:
+            try:
+                cx[i], cy[i] = c[0], c[1]
+            except (TypeError, ValueError):
+                pass
+        elif g:
+            other.append(i)
+    if other:
+        geoms = shapely.from_geojson([json.dumps(feats[i]["geometry"]) for i in other], on_invalid="ignore")
+        valid = ~(shapely.is_missing(geoms) | shapely.is_empty(geoms))
+        idx = np.asarray(other)[valid]
+        cents = shapely.centroid(geoms[valid])
+        cx[idx], cy[idx] = shapely.get_x(cents), shapely.get_y(cents)
+    ok = np.isfinite(cx) & np.isfinite(cy)
+    props_list = []
+    for f, k in zip(feats, ok.tolist()):
+        if k:
+            props = dict(f.get("properties", {}) or {})
+            props.pop("type", None)
+            props.pop("id", None)
+            props_list.append(props)
+    return props_list, cx[ok], cy[ok]
+
+
+class PoiAttacher:
+    """Add parsed POI batches to G and link them to the street network (vertex or segment mode)."""
+
+    def __init__(self, G: nx.Graph, attach_mode: str = "vertex"):
+        self.G = G
+        self.street_nodes = [n for n, d in G.nodes(data=True) if d.get("type") == "street"]
+        self.street_xy = np.asarray(
+            [(G.nodes[n]["x"], G.nodes[n]["y"]) for n in self.street_nodes], dtype=np.float64
+        ).reshape(-1, 2)
+        self.kdt = cKDTree(self.street_xy) if self.street_nodes else None
+        self.snapper = SegmentSnapper(G) if attach_mode == "segment" else None
+
+    def add(self, prefix: str, node_type: str, idx: int,
+            props_list: List[Dict], xs: np.ndarray, ys: np.ndarray) -> int:
+        if not props_list:
+            return idx
+        node_ids = [f"{prefix}_{i}" for i in range(idx, idx + len(props_list))]
+        self.G.add_nodes_from(
+            (nid, dict(props, x=x, y=y, type=node_type))
+            for nid, props, x, y in zip(node_ids, props_list, xs.tolist(), ys.tolist())
+        )
+
+        if self.snapper is not None:
+            self.snapper.attach(node_ids, xs, ys)
+        elif self.kdt is not None:
+            dists, sidx = self.kdt.query(np.column_stack([xs, ys]), k=1)
+            sxy = self.street_xy[sidx]
+            self.G.add_edges_from(
+                (nid, self.street_nodes[si], {"type": "access", "line": [(x, y), (sx, sy)], "distance": d})
+                for nid, si, x, y, sx, sy, d in zip(
+                    node_ids, sidx.tolist(), xs.tolist(), ys.tolist(),
+                    sxy[:, 0].tolist(), sxy[:, 1].tolist(), dists.tolist())
+            )
+        return idx + len(props_list)
+
+
+def _poi_loop(G: nx.Graph):
+    """Per-feature POI path (no Shapely 2 / SciPy): returns add_pois(src, prefix, node_type)."""
     street_nodes = [n for n, d in G.nodes(data=True) if d.get("type") == "street"]
     street_coords = [(G.nodes[n]["x"], G.nodes[n]["y"]) for n in street_nodes]
 
@@ -116,11 +424,9 @@ def build_graph(streets_json: Dict, buildings_json: Dict, greens_json: Dict) ->
                 best_d2, best_sid = d2, sid
         return (best_sid, math.sqrt(best_d2)) if best_sid is not None else (None, float("inf"))
 
-    def add_pois(src_json: Dict, prefix: str, node_type: str):
-        if not src_json:
-            return
+    def add_pois(src_json: FeatureSource, prefix: str, node_type: str):
         idx = 0
-        for feat in src_json.get("features", []):
+        for feat in iter_features(src_json):
             try:
                 geom = shape(feat.get("geometry"))
                 if geom.is_empty:
@@ -150,14 +456,154 @@ def build_graph(streets_json: Dict, buildings_json: Dict, greens_json: Dict) ->
                         distance=float(dist)
                     )
 
+    return add_pois
+
+
+def build_graph(streets_json: FeatureSource, buildings_json: FeatureSource, greens_json: FeatureSource,
+                snap_mode: str = "incremental", attach_mode: str = "vertex") -> nx.Graph:
+    """
+    Each layer is a FeatureCollection dict or a feature iterator (consumed once).
+    snap_mode: "incremental" welds street vertices one by one; "bulk" finds all close
+    coordinates at once with NumPy/SciPy and gives the same graph (falls back to
+    incremental without SciPy).
+    attach_mode: "vertex" links each POI to the nearest street vertex; "segment" projects
+    it onto the nearest street segment and splits it there (needs Shapely 2 + SciPy,
+    otherwise vertex mode).
+    """
+    G = nx.Graph()
+
+    # ---- 1) Streets: create/merge vertices and edges ----
+    if snap_mode == "bulk" and cKDTree is not None:
+        _add_streets_bulk(G, streets_json)
+    else:
+        _add_streets_incremental(G, streets_json)
+
+    # ---- 2) POIs: connect centroid to nearest street vertex ----
+    if _VECTOR_POIS:
+        attacher = PoiAttacher(G, attach_mode)
+
+        def add_pois(src_json: FeatureSource, prefix: str, node_type: str):
+            """Batched: Shapely 2 array parsing/centroids and one KD-tree query per batch."""
+            idx, batch = 0, []
+            for feat in iter_features(src_json):
+                if not feat.get("geometry"):
+                    continue
+                batch.append(feat)
+                if len(batch) >= POI_BATCH:
+                    idx = attacher.add(prefix, node_type, idx, *parse_poi_batch(batch))
+                    batch = []
+            if batch:
+                attacher.add(prefix, node_type, idx, *parse_poi_batch(batch))
+    else:
+        add_pois = _poi_loop(G)
+
     add_pois(buildings_json, "building", "building")
     add_pois(greens_json, "green", "green")
 
     return G
 
 
+# ---------------- Tiled, multi-process build ----------------
+def _tile_pairs(args):
+    """
+    Worker: candidate weld pairs (i < j, global coordinate indices) whose later member j
+    lies in this tile. halo holds the coordinates of neighbouring tiles within the
+    tolerance of the tile, so pairs across a seam are found exactly once.
+    """
+    idx, xy, halo_idx, halo_xy = args
+    tree = cKDTree(xy)
+    out = [idx[tree.query_pairs(r=_PAIR_R, output_type="ndarray")].reshape(-1, 2)]
+    if len(halo_idx):
+        hits = tree.query_ball_point(halo_xy, r=_PAIR_R)
+        cross = [(h, t) for h, ts in zip(halo_idx.tolist(), hits) for t in idx[ts].tolist() if h < t]
+        out.append(np.asarray(cross, dtype=np.int64).reshape(-1, 2))
+    pairs = np.vstack(out)
+    return np.sort(pairs, axis=1)
+
+
+def _add_streets_tiled(G: nx.Graph, streets_json: FeatureSource, tile_m: float, pool: ProcessPoolExecutor):
+    """
+    Split the neighbour search over tile_m squares in the pool, then weld in the parent
+    by the per-vertex rule. Segments are never cut at seams, so the street graph is
+    identical to the serial build for any tile size.
+    """
+    xy, part_len = _street_coords(streets_json)
+    if not len(xy):
+        return
+    tile_m = max(float(tile_m), 2.0 * TOLERANCE_M)  # halo only reaches the 8 neighbours
+    cell = np.floor(xy / tile_m).astype(np.int64)
+    cell_l = cell.tolist()
+
+    # Each coordinate belongs to one tile; it is halo of a neighbour it is within tolerance of
+    members: Dict[Tuple[int, int], List[int]] = defaultdict(list)
+    for g, (i, j) in enumerate(cell_l):
+        members[(i, j)].append(g)
+    halo: Dict[Tuple[int, int], List[int]] = defaultdict(list)
+    lo, hi = xy - cell * tile_m, (cell + 1) * tile_m - xy  # distance to the own tile's sides
+    for di in (-1, 0, 1):
+        for dj in (-1, 0, 1):
+            if di == dj == 0:
+                continue
+            gap_x = lo[:, 0] if di < 0 else (hi[:, 0] if di > 0 else np.zeros(len(xy)))
+            gap_y = lo[:, 1] if dj < 0 else (hi[:, 1] if dj > 0 else np.zeros(len(xy)))
+            for g in np.nonzero(np.hypot(gap_x, gap_y) <= _PAIR_R)[0].tolist():
+                halo[(cell_l[g][0] + di, cell_l[g][1] + dj)].append(g)
+
+    jobs = []
+    for key in sorted(members):
+        idx = np.asarray(members[key], dtype=np.int64)
+        h = np.asarray(halo.get(key, ()), dtype=np.int64)
+        jobs.append((idx, xy[idx], h, xy[h].reshape(-1, 2)))
+    pairs = np.vstack(list(pool.map(_tile_pairs, jobs)) or [np.empty((0, 2), dtype=np.int64)])
+    _emit_streets(G, xy, part_len, _weld_pairs(xy, pairs))
+
+
+def build_graph_tiled(streets_json: FeatureSource, buildings_json: FeatureSource, greens_json: FeatureSource,
+                      tile_m: float = 500.0, workers: int = 0, attach_mode: str = "vertex") -> nx.Graph:
+    """
+    Multi-process variant of build_graph for large radii: the street neighbour search runs
+    per tile in a ProcessPoolExecutor and POI batches are parsed in the pool, then attached
+    in the parent with one KD-tree (or the segment snapper). Same graph as build_graph.
+    """
+    G = nx.Graph()
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        if cKDTree is not None:
+            _add_streets_tiled(G, streets_json, tile_m, pool)
+        else:
+            _add_streets_incremental(G, streets_json)
+
+        if not _VECTOR_POIS:
+            add_pois = _poi_loop(G)
+            add_pois(buildings_json, "building", "building")
+            add_pois(greens_json, "green", "green")
+            return G
+
+        attacher = PoiAttacher(G, attach_mode)
+        for src, prefix, node_type in ((buildings_json, "building", "building"), (greens_json, "green", "green")):
+            batches, batch = [], []
+            for feat in iter_features(src):
+                if not feat.get("geometry"):
+                    continue
+                batch.append(feat)
+                if len(batch) >= POI_BATCH:
+                    batches.append(batch)
+                    batch = []
+            if batch:
+                batches.append(batch)
+            idx = 0
+            for parsed in pool.map(parse_poi_batch, batches):
+                idx = attacher.add(prefix, node_type, idx, *parsed)
+    return G
+
+
 def simplify_graph(data: Dict[str, Any]) -> Dict[str, Any]:
-    """Simplify by contracting degree-2 street nodes and preserving connectivity."""
+    """
+    Simplify by contracting degree-2 street nodes and preserving connectivity.
+
+    Single pass, O(V+E): every chain of removable nodes is walked once from one of
+    its kept ends; each removed node is labelled with its chain and position, so
+    POI edges on removed nodes are rewired by lookup instead of a search.
+    """
     from collections import defaultdict, deque
 
     nodes = data["nodes"]
@@ -206,13 +652,19 @@ def simplify_graph(data: Dict[str, Any]) -> Dict[str, Any]:
             return list(reversed(line))
         return line
 
-    # Contract street chains
+    # Contract street chains. chain_pos[removed] = (chain index, hops from chain start,
+    # whether its first street neighbour points back towards the start)
+    chains = []  # (start, end, number of removed nodes)
+    chain_pos = {}
     visited_pairs = set()
     contracted_edges = []
-    for start in list(kept_nodes):
-        if ntype(start) != "street":
+    for n in nodes:
+        start = n["id"]
+        if start not in kept_nodes or ntype(start) != "street":
             continue
         for nbr in adj_street[start]:
+            if nbr in chain_pos:
+                continue  # chain already walked from its other end
             prev, curr = start, nbr
             total_dist = 0.0
             merged_line = []
@@ -221,8 +673,11 @@ def simplify_graph(data: Dict[str, Any]) -> Dict[str, Any]:
                 total_dist += float(e0.get("distance", 0.0) or 0.0)
                 seg = oriented_line(prev, curr, e0)
                 merged_line.extend(seg)
+            ci, hops = len(chains), 0
             while curr in to_remove:
                 nbrs = adj_street[curr]
+                hops += 1
+                chain_pos[curr] = (ci, hops, bool(nbrs) and nbrs[0] == prev)
                 if len(nbrs) != 2:
                     break
                 nxt = nbrs[0] if nbrs[1] == prev else nbrs[1]
@@ -236,6 +691,7 @@ def simplify_graph(data: Dict[str, Any]) -> Dict[str, Any]:
                         merged_line.extend(seg)
                 prev, curr = curr, nxt
             end = curr
+            chains.append((start, end, hops))
             if start == end:
                 continue
             key = tuple(sorted([start, end]))
@@ -258,8 +714,18 @@ def simplify_graph(data: Dict[str, Any]) -> Dict[str, Any]:
                 visited_pairs.add(key)
                 contracted_edges.append(e)
 
-    # Rewire POI edges if their street endpoint was removed
+    # Rewire POI edges if their street endpoint was removed: the nearest kept chain
+    # end by hops (ties go to the side of the node's first street neighbour)
     def nearest_kept_street(start_removed):
+        pos = chain_pos.get(start_removed)
+        if pos is not None:
+            start, end, n = chains[pos[0]]
+            if end in kept_nodes:
+                to_start, to_end = pos[1], n + 1 - pos[1]
+                if to_start < to_end or (to_start == to_end and pos[2]):
+                    return start
+                return end
+        # Chains without two kept ends (closed loops, malformed adjacency): plain BFS
         q = deque([start_removed])
         seen = {start_removed}
         while q:
@@ -270,8 +736,11 @@ def simplify_graph(data: Dict[str, Any]) -> Dict[str, Any]:
                 if nxt not in seen:
                     seen.add(nxt)
                     q.append(nxt)
+        for cur in seen:  # whole component is unreachable; don't search it again
+            rewired[cur] = None
         return None
 
+    rewired = {}
     other_edges = []
     for e in edges:
         if e.get("type") == "street":
@@ -283,7 +752,9 @@ def simplify_graph(data: Dict[str, Any]) -> Dict[str, Any]:
             if s in kept_nodes:
                 other_edges.append(e)
             else:
-                tgt = nearest_kept_street(s)
+                if s not in rewired:
+                    rewired[s] = nearest_kept_street(s)
+                tgt = rewired[s]
                 if tgt:
                     other_edges.append({**e, "u": poi, "v": tgt})
         else:
@@ -294,39 +765,49 @@ def simplify_graph(data: Dict[str, Any]) -> Dict[str, Any]:
     return {"nodes": new_nodes, "edges": contracted_edges + other_edges}
 
 
-def export_graph_json(G: nx.Graph, out_path: str):
-    data = {
-        "nodes": [
-            {
-                "id": n,
-                "x": d.get("x"),
-                "y": d.get("y"),
-                "type": d.get("type"),
-                **{k: v for k, v in d.items() if k not in ("x", "y", "type")}
-            }
-            for n, d in G.nodes(data=True)
-            if "x" in d and "y" in d
-        ],
-        "edges": [
-            {"u": u, "v": v, "type": d.get("type"),
-             "distance": d.get("distance"), "line": d.get("line")}
-            for u, v, d in G.edges(data=True)
-            if "line" in d
-        ]
-    }
+def export_graph_json(G: Union[nx.Graph, UrbanGraph], out_path: str, metrics=NO_METRICS):
+    if isinstance(G, UrbanGraph):
+        data = G.to_json()
+    else:
+        data = {
+            "nodes": [
+                {
+                    "id": n,
+                    "x": d.get("x"),
+                    "y": d.get("y"),
+                    "type": d.get("type"),
+                    **{k: v for k, v in d.items() if k not in ("x", "y", "type")}
+                }
+                for n, d in G.nodes(data=True)
+                if "x" in d and "y" in d
+            ],
+            "edges": [
+                {"u": u, "v": v, "type": d.get("type"),
+                 "distance": d.get("distance"), "line": d.get("line")}
+                for u, v, d in G.edges(data=True)
+                if "line" in d
+            ]
+        }
 
     # Raw graph
     job_dir = os.path.dirname(out_path)
     os.makedirs(job_dir, exist_ok=True)
-    with open(out_path, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2)
+    with metrics.stage("graph_write", nodes=len(data["nodes"]), edges=len(data["edges"])):
+        with open(out_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+        # Binary companions are written after the JSON so readers see them as fresh
+        write_graph_binary(data, binary_path_for(out_path))
 
     # Simplified graph
-    simplified = simplify_graph(data)
+    with metrics.stage("simplify") as rec:
+        simplified = simplify_graph(data)
+        rec.update(nodes=len(simplified["nodes"]), edges=len(simplified["edges"]))
     osm_root = os.path.dirname(job_dir)
     context_path = os.path.join(osm_root, "graph_context.json")
-    with open(context_path, "w", encoding="utf-8") as f:
-        json.dump(simplified, f, indent=2)
+    with metrics.stage("graph_context_write"):
+        with open(context_path, "w", encoding="utf-8") as f:
+            json.dump(simplified, f, indent=2)
+        write_graph_binary(simplified, binary_path_for(context_path))
 
     print(
         "[graph_builder] Wrote raw graph.json (job) and simplified graph_context.json (osm root): "
@@ -335,6 +816,91 @@ def export_graph_json(G: nx.Graph, out_path: str):
     )
 
 
+# ---------------- Layer files ----------------
+def gdf_features(gdf) -> Iterable[Dict[str, Any]]:
+    """
+    GeoJSON-like features of a GeoDataFrame with the properties to_file(GeoJSON)
+    would write (a named index such as osmnx's (element, id) becomes columns).
+    """
+    if list(gdf.index.names) != [None]:
+        gdf = gdf.reset_index()
+    return gdf.iterfeatures(na="null", show_bbox=False)
+
+
+def layer_path(out_dir: str, name: str) -> Union[str, None]:
+    """Preferred existing file for a layer ('streets', ...) or None."""
+    for ext in LAYER_EXTS:
+        p = os.path.join(out_dir, name + ext)
+        if os.path.exists(p):
+            if ext != ".geojson" and gpd is None:
+                continue
+            return p
+    return None
+
+
+def iter_layer_features(path: str) -> Iterable[Dict[str, Any]]:
+    """Features of a layer file; GeoJSON is streamed, columnar files read via GeoPandas."""
+    if path.endswith(".geojson"):
+        return iter_geojson_features(path)
+    gdf = gpd.read_parquet(path) if path.endswith(".parquet") else gpd.read_file(path)
+    return gdf_features(gdf)
+
+
+# ---------------- Build cache ----------------
+_CACHE_FILES = ("graph.json", "graph.ugb", "graph_context.json", "graph_context.ugb")
+
+
+def _file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def build_cache_key(streets_p: str, buildings_p: str, greens_p: str) -> str:
+    """Content hash of the three layers plus every setting that changes the output."""
+    h = hashlib.sha256()
+    for p in (streets_p, buildings_p, greens_p):
+        h.update(_file_sha256(p).encode("ascii"))
+    settings = [BUILDER_VERSION, repr(TOLERANCE_M), ATTACH_MODE,
+                SNAP_MODE if TILE_M <= 0 else "tiled:{!r}".format(TILE_M)]
+    h.update("|".join(settings).encode("utf-8"))
+    return h.hexdigest()[:32]
+
+
+def _cache_restore(key: str, out_dir: str) -> bool:
+    """Copy a cached build into out_dir (raw graph) and its parent (context graph)."""
+    entry = os.path.join(GRAPH_CACHE_DIR, key)
+    if not all(os.path.isfile(os.path.join(entry, name)) for name in _CACHE_FILES):
+        return False
+    osm_root = os.path.dirname(out_dir)
+    # Fresh mtimes (watchers poll them); JSON before binary so each .ugb stays the newer
+    for name in _CACHE_FILES:
+        dst_dir = out_dir if name.startswith("graph.") else osm_root
+        shutil.copyfile(os.path.join(entry, name), os.path.join(dst_dir, name))
+    os.utime(entry, None)  # LRU marker for pruning
+    return True
+
+
+def _cache_store(key: str, out_dir: str):
+    osm_root = os.path.dirname(out_dir)
+    entry = os.path.join(GRAPH_CACHE_DIR, key)
+    tmp = entry + ".tmp{}".format(os.getpid())
+    os.makedirs(tmp, exist_ok=True)
+    for name in _CACHE_FILES:
+        src_dir = out_dir if name.startswith("graph.") else osm_root
+        shutil.copyfile(os.path.join(src_dir, name), os.path.join(tmp, name))
+    shutil.rmtree(entry, ignore_errors=True)
+    os.replace(tmp, entry)
+
+    entries = [os.path.join(GRAPH_CACHE_DIR, d) for d in os.listdir(GRAPH_CACHE_DIR)
+               if ".tmp" not in d and os.path.isdir(os.path.join(GRAPH_CACHE_DIR, d))]
+    entries.sort(key=os.path.getmtime, reverse=True)
+    for old in entries[max(1, GRAPH_CACHE_MAX):]:
+        shutil.rmtree(old, ignore_errors=True)
+
+
 def _resolve_out_dir() -> str:
     if len(sys.argv) >= 2 and sys.argv[1]:
         return os.path.abspath(sys.argv[1])
@@ -350,12 +916,10 @@ def _resolve_out_dir() -> str:
     if not subdirs:
         raise IOError("No OSM job folders found under {}".format(base_dir))
 
-    REQUIRED = {"streets.geojson", "buildings.geojson", "greens.geojson"}
-
     complete = []
     for d in subdirs:
         files = set(os.listdir(d))
-        if REQUIRED.issubset(files) or "DONE.txt" in files:
+        if all(any(n + ext in files for ext in LAYER_EXTS) for n in LAYER_NAMES) or "DONE.txt" in files:
             complete.append(d)
 
     if complete:
@@ -364,31 +928,81 @@ def _resolve_out_dir() -> str:
     return max(subdirs, key=os.path.getmtime)
 
 
+def build_and_export(out_dir: str, streets: FeatureSource, buildings: FeatureSource,
+                     greens: FeatureSource, metrics=NO_METRICS):
+    """
+    Build with the configured mode and write graph.json (+ graph_context.json).
+    Entry point for in-process callers (osm_worker) that already hold the features.
+    """
+    with metrics.stage("graph_build") as rec:
+        if TILE_M > 0:
+            G = build_graph_tiled(streets, buildings, greens, tile_m=TILE_M,
+                                  workers=BUILD_WORKERS, attach_mode=ATTACH_MODE)
+        else:
+            G = build_graph(streets, buildings, greens, snap_mode=SNAP_MODE, attach_mode=ATTACH_MODE)
+        rec.update(nodes=G.number_of_nodes(), edges=G.number_of_edges())
+    export_graph_json(G, os.path.join(out_dir, "graph.json"), metrics=metrics)
+
+
+def lookup_build_cache(out_dir: str, metrics=NO_METRICS):
+    """
+    (key, hit) for out_dir's layer files: key is None when caching is off or a layer
+    file is missing; hit means the cached outputs were restored into place.
+    """
+    paths = [layer_path(out_dir, name) for name in LAYER_NAMES]
+    with metrics.stage("graph_cache_lookup") as rec:
+        key = build_cache_key(*paths) if GRAPH_CACHE and all(paths) else None
+        rec["hit"] = bool(key) and _cache_restore(key, out_dir)
+    if rec["hit"]:
+        print("[graph_builder] Cache hit {}: copied graph.json and graph_context.json".format(key))
+    return key, rec["hit"]
+
+
+def store_build_cache(out_dir: str, key: Union[str, None] = None):
+    """Store out_dir's outputs under key (default: hash of its layer files); never raises."""
+    try:
+        if key is None:
+            key = build_cache_key(*(layer_path(out_dir, name) for name in LAYER_NAMES))
+        _cache_store(key, out_dir)
+    except OSError as e:
+        print("[graph_builder] Could not store build cache entry:", e)
+
+
+def mark_graph_done(out_dir: str):
+    with open(os.path.join(out_dir, "GRAPH_DONE.txt"), "w", encoding="utf-8") as f:
+        f.write("ok")
+
+
 def main():
     out_dir = _resolve_out_dir()
     print("[graph_builder] Using OUT_DIR:", out_dir)
 
-    streets_p = os.path.join(out_dir, "streets.geojson")
-    buildings_p = os.path.join(out_dir, "buildings.geojson")
-    greens_p = os.path.join(out_dir, "greens.geojson")
-
     deadline = time.time() + 30.0
-    while time.time() < deadline and not all(os.path.exists(p) for p in (streets_p, buildings_p, greens_p)):
+    while time.time() < deadline and not all(layer_path(out_dir, n) for n in LAYER_NAMES):
         time.sleep(0.5)
 
-    missing = [p for p in (streets_p, buildings_p, greens_p) if not os.path.exists(p)]
+    missing = [n for n in LAYER_NAMES if not layer_path(out_dir, n)]
     if missing:
-        raise IOError("Missing required GeoJSON files:\n  " + "\n  ".join(missing))
-
-    streets = load_geojson(streets_p)
-    buildings = load_geojson(buildings_p)
-    greens = load_geojson(greens_p)
-
-    G = build_graph(streets, buildings, greens)
-    export_graph_json(G, os.path.join(out_dir, "graph.json"))
-
-    with open(os.path.join(out_dir, "GRAPH_DONE.txt"), "w", encoding="utf-8") as f:
-        f.write("ok")
+        raise IOError("Missing required layer files ({}):\n  ".format("/".join(LAYER_EXTS))
+                      + "\n  ".join(os.path.join(out_dir, n) for n in missing))
+    streets_p, buildings_p, greens_p = (layer_path(out_dir, n) for n in LAYER_NAMES)
+    print("[graph_builder] Layers:", ", ".join(os.path.basename(p) for p in (streets_p, buildings_p, greens_p)))
+
+    metrics = JobMetrics(out_dir)
+    key, hit = lookup_build_cache(out_dir, metrics)
+    if hit:
+        mark_graph_done(out_dir)
+        return
+
+    # GeoJSON is streamed so peak memory does not scale with the layer files
+    build_and_export(out_dir,
+                     iter_layer_features(streets_p),
+                     iter_layer_features(buildings_p),
+                     iter_layer_features(greens_p),
+                     metrics=metrics)
+    if key:
+        store_build_cache(out_dir, key)
+    mark_graph_done(out_dir)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,137 @@
+# job_metrics.py - per-stage wall time / RSS change / counts for OSM jobs
+# Stages are written to <job_dir>/job_metrics.json as they finish, so /osm/status
+# can report progress while a job is still running. Several processes may add
+# stages to the same file (osm_worker and a graph_builder subprocess); each write
+# merges with what is already on disk.
+
+import os
+import sys
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+try:
+    import resource  # POSIX
+except ImportError:
+    resource = None
+
+try:
+    import psutil  # optional; the only memory source on Windows
+except Exception:
+    psutil = None
+
+METRICS_FILE = "job_metrics.json"
+
+
+_PAGE_MB = os.sysconf("SC_PAGE_SIZE") / (1024.0 * 1024.0) if hasattr(os, "sysconf") else None
+
+
+def rss_mb():
+    """Current resident set size of this process (MB), or None if unknown."""
+    if _PAGE_MB is not None and os.path.exists("/proc/self/statm"):
+        try:
+            with open("/proc/self/statm", "r") as f:
+                return round(int(f.read().split()[1]) * _PAGE_MB, 1)
+        except (OSError, ValueError, IndexError):
+            pass
+    if psutil is not None:
+        return round(psutil.Process().memory_info().rss / (1024.0 * 1024.0), 1)
+    return None
+
+
+def peak_rss_mb():
+    """
+    Peak resident set size of this process so far (MB), or None if unknown. This is a
+    process-lifetime high-water mark: a warm worker carries it over from earlier jobs.
+    """
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is KiB on Linux, bytes on macOS
+        return round(peak / (1024.0 * 1024.0) if sys.platform == "darwin" else peak / 1024.0, 1)
+    if psutil is not None:
+        mem = psutil.Process().memory_info()
+        return round(getattr(mem, "peak_wset", mem.rss) / (1024.0 * 1024.0), 1)
+    return None
+
+
+def read_job_metrics(job_dir):
+    """Parsed job_metrics.json of a job dir, or None."""
+    try:
+        with open(os.path.join(job_dir, METRICS_FILE), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+class JobMetrics:
+    """
+    Usage:
+        m = JobMetrics(out_dir)
+        with m.stage("projection") as rec:
+            ...
+            rec["features"] = len(gdf)
+    Each stage records {"seconds", "rss_start_mb", "rss_end_mb", "rss_delta_mb",
+    "process_peak_rss_mb", **counts}. RSS is sampled for the whole process, so stages
+    running concurrently in threads see each other's allocations. Thread-safe.
+    """
+
+    def __init__(self, job_dir):
+        self.path = os.path.join(job_dir, METRICS_FILE)
+        self.t0 = time.time()
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name, **counts):
+        rec = dict(counts)
+        t0, rss0 = time.time(), rss_mb()
+        try:
+            yield rec
+        finally:
+            rss1 = rss_mb()
+            rec["seconds"] = round(time.time() - t0, 3)
+            rec["rss_start_mb"], rec["rss_end_mb"] = rss0, rss1
+            rec["rss_delta_mb"] = round(rss1 - rss0, 1) if rss0 is not None and rss1 is not None else None
+            rec["process_peak_rss_mb"] = peak_rss_mb()
+            with self._lock:
+                self.stages[name] = rec
+            self.write()
+
+    def set(self, name, **counts):
+        """Add counts to a stage (creating it if needed) without timing anything."""
+        with self._lock:
+            self.stages.setdefault(name, {}).update(counts)
+        self.write()
+
+    def write(self):
+        with self._lock:
+            data = read_job_metrics(os.path.dirname(self.path)) or {}
+            stages = data.get("stages", {})
+            stages.update(self.stages)
+            data.update({
+                "updated": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "process_peak_rss_mb": max([s.get("process_peak_rss_mb") or 0 for s in stages.values()] or [0]),
+                "stages": stages,
+            })
+            tmp = self.path + ".tmp{0}".format(os.getpid())
+            try:
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump(data, f, indent=2)
+                os.replace(tmp, self.path)
+            except OSError as e:
+                print("[job_metrics] Could not write {0}: {1}".format(self.path, e), flush=True)
+
+
+class _NoMetrics:
+    """Stand-in when a caller does not collect metrics."""
+
+    @contextmanager
+    def stage(self, name, **counts):
+        yield dict(counts)
+
+    def set(self, name, **counts):
+        pass
+
+
+NO_METRICS = _NoMetrics()
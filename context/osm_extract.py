@@ -0,0 +1,136 @@
+# osm_extract.py - serve OSM layers from a local .osm / .osm.pbf extract (no Overpass)
+# The extract is parsed once into a persistent tile index (same tile layout as
+# osm_tile_cache); later LAT/LON/RADIUS_KM windows are assembled from those tiles.
+#
+# Index: <EXTRACT_INDEX_DIR>/<extract-hash>/index.json + <tags_hash>/<ix>_<iy>.pkl
+# The index is rebuilt when the extract's path, size or mtime changes.
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import subprocess
+
+import osmnx as ox
+from shapely.geometry import box
+
+from osm_tile_cache import TileCache, TILE_DEG, tiles_for_bbox, tile_bbox, tags_key
+
+try:
+    import osmium  # pyosmium, optional: only needed for .pbf without the osmium CLI
+except Exception:
+    osmium = None
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+EXTRACT_INDEX_DIR = os.environ.get("OSM_EXTRACT_INDEX_DIR", os.path.join(PROJECT_ROOT, "cache", "extracts"))
+
+_INDEX_VERSION = 1
+
+
+def _extract_id(path):
+    st = os.stat(path)
+    blob = "{0}|{1}|{2}".format(os.path.abspath(path), st.st_size, int(st.st_mtime))
+    return hashlib.sha1(blob.encode("utf-8")).hexdigest()[:16]
+
+
+def _pbf_to_xml(pbf_path, xml_path):
+    """Convert .osm.pbf to .osm XML (osmium CLI if present, else pyosmium)."""
+    if shutil.which("osmium"):
+        subprocess.check_call(["osmium", "cat", pbf_path, "-o", xml_path, "--overwrite"])
+        return
+    if osmium is None:
+        raise RuntimeError("Reading .osm.pbf needs the osmium CLI or the pyosmium package")
+
+    class _Copy(osmium.SimpleHandler):
+        def __init__(self, writer):
+            super(_Copy, self).__init__()
+            self.writer = writer
+
+        def node(self, n):
+            self.writer.add_node(n)
+
+        def way(self, w):
+            self.writer.add_way(w)
+
+        def relation(self, r):
+            self.writer.add_relation(r)
+
+    writer = osmium.SimpleWriter(xml_path)
+    try:
+        _Copy(writer).apply_file(pbf_path)
+    finally:
+        writer.close()
+
+
+class ExtractIndex:
+    """Persistent tile index over one local extract for one tag filter."""
+
+    def __init__(self, extract_path, tags, index_dir=EXTRACT_INDEX_DIR, tile_deg=TILE_DEG):
+        self.extract_path = os.path.abspath(extract_path)
+        self.tags = tags
+        self.tile_deg = tile_deg
+        self.root = os.path.join(index_dir, _extract_id(self.extract_path))
+        self.cache = TileCache(tags, cache_dir=self.root, offline_dir="", tile_deg=tile_deg,
+                               ttl_days=0, offline=True)
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.root, "index.json")
+
+    def _manifest(self):
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                m = json.load(f)
+        except (OSError, ValueError):
+            return None
+        ok = (m.get("version") == _INDEX_VERSION and m.get("tags_key") == tags_key(self.tags)
+              and m.get("tile_deg") == self.tile_deg)
+        return m if ok else None
+
+    def ensure(self):
+        """Build the index if missing or stale; returns the manifest."""
+        m = self._manifest()
+        if m is not None:
+            return m
+        t0 = time.time()
+        print("[osm_extract] Indexing {0} (one-off)...".format(self.extract_path), flush=True)
+        src, tmp_dir = self.extract_path, None
+        if src.lower().endswith(".pbf"):
+            tmp_dir = tempfile.mkdtemp(prefix="osm_extract_")
+            src = os.path.join(tmp_dir, "extract.osm")
+            _pbf_to_xml(self.extract_path, src)
+        try:
+            gdf = ox.features_from_xml(src, tags=self.tags)
+        finally:
+            if tmp_dir:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        # Every tile inside the extract's extent gets an entry (possibly empty) so
+        # windows that fall in feature-free areas are still answered offline
+        west, south, east, north = (float(v) for v in gdf.total_bounds)
+        tiles = tiles_for_bbox((west, south, east, north), self.tile_deg)
+        os.makedirs(self.root, exist_ok=True)
+        for t in tiles:
+            hits = gdf.sindex.query(box(*tile_bbox(t, self.tile_deg)), predicate="intersects")
+            hits.sort()
+            self.cache._store(t, gdf.iloc[hits])
+
+        m = {"version": _INDEX_VERSION, "extract": self.extract_path, "tags_key": tags_key(self.tags),
+             "tile_deg": self.tile_deg, "bbox": [west, south, east, north],
+             "features": int(len(gdf)), "tiles": len(tiles), "built_s": round(time.time() - t0, 3)}
+        with open(self.manifest_path, "w", encoding="utf-8") as f:
+            json.dump(m, f, indent=2)
+        print("[osm_extract] Indexed {features} features into {tiles} tiles in {built_s} s".format(**m),
+              flush=True)
+        return m
+
+    def features(self, location_point, dist_m):
+        """Same selection as ox.features_from_point, read from the index only."""
+        self.ensure()
+        try:
+            return self.cache.features(location_point, dist_m)
+        except IOError:
+            raise IOError("Window at {0} (dist {1} m) is outside extract {2}".format(
+                location_point, dist_m, self.extract_path))
@@ -2,13 +2,14 @@
 # Import GeoJSON files (streets, buildings, greens) into Rhino layers
 
 import os
-import json
 import rhinoscriptsyntax as rs
 import Rhino
 import scriptcontext as sc
 import Rhino.Geometry as rg
 import System.Drawing as sd
 
+from geojson_stream import iter_geojson_features
+
 def _ensure_sublayer(parent_name, child_name):
     
     if not rs.IsLayer(parent_name):
@@ -57,10 +58,7 @@ def _import_geojson(path, layer, expect):
     full_layer_name = _ensure_sublayer("OSM", layer)
     
     count = 0
-    with open(path, "r") as f:
-        data = json.load(f)
-    feats = data.get("features", [])
-    for feat in feats:
+    for feat in iter_geojson_features(path):
         geom = feat.get("geometry") or {}
         gtype = geom.get("type")
         coords = geom.get("coordinates")
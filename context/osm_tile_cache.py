@@ -0,0 +1,173 @@
+# osm_tile_cache.py - spatial cache of OSM features on a fixed lon/lat tile grid
+# A request (point + distance) is assembled from cached tiles; only missing or
+# expired tiles are fetched, in one bbox query. Tiles are small (OSM_TILE_DEG,
+# default 0.002 deg, ~220 m) so a cold query covers little more than the request.
+# A read-only directory of pre-fetched tiles (OSM_OFFLINE_DIR) can serve jobs
+# without network access.
+# Pre-fetch with: python osm_tile_cache.py LAT LON RADIUS_KM [OUT_DIR]
+#
+# Layout: <cache_dir>/<tags_hash>-<tile_deg>/<ix>_<iy>.pkl, one GeoDataFrame
+# (EPSG:4326, as returned by osmnx) per tile holding every feature that
+# intersects the tile.
+
+import os
+import json
+import math
+import time
+import hashlib
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import osmnx as ox
+from shapely.geometry import box
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+TILE_DEG = float(os.environ.get("OSM_TILE_DEG", "0.002"))  # ~220 m of latitude
+TILE_CACHE_DIR = os.environ.get("OSM_TILE_CACHE_DIR", os.path.join(PROJECT_ROOT, "cache", "tiles"))
+TILE_TTL_DAYS = float(os.environ.get("OSM_TILE_TTL_DAYS", "30"))  # <= 0: never expire
+OFFLINE_DIR = os.environ.get("OSM_OFFLINE_DIR", "")        # read-only pre-fetched tiles
+OFFLINE = os.environ.get("OSM_OFFLINE", "0") == "1"        # never touch the network
+
+_EXT = ".pkl"
+
+
+def tags_key(tags):
+    """Stable short hash of a tag filter; tiles of different filters never mix."""
+    blob = json.dumps(tags, sort_keys=True, default=str)
+    return hashlib.sha1(blob.encode("utf-8")).hexdigest()[:12]
+
+
+class EmptyAreaError(ValueError):
+    """No features matching the tag filter in the requested area."""
+
+
+def _is_empty_response(e):
+    # osmnx signals "Overpass returned no features" with InsufficientResponseError,
+    # which is not exported publicly; match it by name instead of importing osmnx._errors
+    return type(e).__name__ == "InsufficientResponseError"
+
+
+def tiles_for_bbox(bbox, tile_deg=TILE_DEG):
+    """Tile indices (ix, iy) covering bbox = (west, south, east, north)."""
+    west, south, east, north = bbox
+    ix0, ix1 = int(math.floor(west / tile_deg)), int(math.floor(east / tile_deg))
+    iy0, iy1 = int(math.floor(south / tile_deg)), int(math.floor(north / tile_deg))
+    return [(ix, iy) for ix in range(ix0, ix1 + 1) for iy in range(iy0, iy1 + 1)]
+
+
+def tile_bbox(tile, tile_deg=TILE_DEG):
+    ix, iy = tile
+    return (ix * tile_deg, iy * tile_deg, (ix + 1) * tile_deg, (iy + 1) * tile_deg)
+
+
+class TileCache:
+    """
+    Tile store for one tag filter. fetcher(bbox, tags) -> GeoDataFrame does the
+    network query (default ox.features_from_bbox); callers wrap it with retries.
+    """
+
+    def __init__(self, tags, fetcher=None, cache_dir=TILE_CACHE_DIR, offline_dir=OFFLINE_DIR,
+                 tile_deg=TILE_DEG, ttl_days=TILE_TTL_DAYS, offline=OFFLINE):
+        self.tags = tags
+        self.fetcher = fetcher or (lambda bbox, tags: ox.features_from_bbox(bbox, tags=tags))
+        self.key = tags_key(tags)
+        self.tile_deg = tile_deg
+        self.ttl_s = ttl_days * 86400.0
+        self.offline = offline
+        grid = "{0}-{1:g}".format(self.key, tile_deg)  # tile names only mean something on one grid
+        self.cache_dir = os.path.join(cache_dir, grid)
+        self.offline_dirs = [os.path.join(offline_dir, grid), offline_dir] if offline_dir else []
+        self.stats = {"tiles": 0, "hits": 0, "fetched": 0}
+
+    def _tile_name(self, tile):
+        return "{0}_{1}{2}".format(tile[0], tile[1], _EXT)
+
+    def _load(self, tile):
+        """Cached tile or None. Offline tiles never expire; local ones honour the TTL."""
+        name = self._tile_name(tile)
+        candidates = [(os.path.join(d, name), False) for d in self.offline_dirs]
+        candidates.append((os.path.join(self.cache_dir, name), True))
+        for path, expires in candidates:
+            if not os.path.isfile(path):
+                continue
+            if expires and self.ttl_s > 0 and time.time() - os.path.getmtime(path) > self.ttl_s:
+                continue
+            try:
+                return pd.read_pickle(path)
+            except Exception as e:
+                print("[tile_cache] Ignoring unreadable tile {0}: {1}".format(path, e), flush=True)
+        return None
+
+    def _store(self, tile, gdf):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = os.path.join(self.cache_dir, self._tile_name(tile))
+        tmp = path + ".tmp{0}".format(os.getpid())
+        gdf.to_pickle(tmp)
+        os.replace(tmp, path)
+
+    def _fetch(self, tiles):
+        """One bbox query over all missing tiles, split into per-tile frames."""
+        bboxes = [tile_bbox(t, self.tile_deg) for t in tiles]
+        bbox = (min(b[0] for b in bboxes), min(b[1] for b in bboxes),
+                max(b[2] for b in bboxes), max(b[3] for b in bboxes))
+        try:
+            gdf = self.fetcher(bbox, self.tags)
+        except Exception as e:
+            if not _is_empty_response(e):
+                raise
+            gdf = gpd.GeoDataFrame(geometry=[], crs="EPSG:4326")
+        out = {}
+        for t, b in zip(tiles, bboxes):
+            part = gdf.iloc[np.sort(gdf.sindex.query(box(*b), predicate="intersects"))] if len(gdf) else gdf
+            out[t] = part
+            self._store(t, part)
+        return out
+
+    def features(self, location_point, dist_m):
+        """
+        GeoDataFrame of features intersecting the bbox around location_point, the same
+        selection ox.features_from_point makes.
+        """
+        bbox = ox.utils_geo.bbox_from_point(location_point, dist=dist_m)  # (west, south, east, north)
+        tiles = tiles_for_bbox(bbox, self.tile_deg)
+        parts, missing = [], []
+        for t in tiles:
+            gdf = self._load(t)
+            if gdf is None:
+                missing.append(t)
+            else:
+                parts.append(gdf)
+        self.stats.update(tiles=len(tiles), hits=len(tiles) - len(missing), fetched=len(missing))
+        if missing:
+            if self.offline:
+                raise IOError("OSM_OFFLINE=1 but {0} of {1} tiles are not cached (e.g. {2})".format(
+                    len(missing), len(tiles), missing[0]))
+            parts.extend(self._fetch(missing).values())
+        parts = [p for p in parts if len(p)]
+        if not parts:
+            raise EmptyAreaError("No matching features in any tile")
+        gdf = pd.concat(parts)
+        gdf = gdf[~gdf.index.duplicated(keep="first")]
+        gdf = gdf.iloc[np.sort(gdf.sindex.query(box(*bbox), predicate="intersects"))]
+        if len(gdf) == 0:
+            raise EmptyAreaError("No matching features in the requested area")
+        return gdf
+
+
+
+def main():
+    """Pre-fetch tiles for offline use: python osm_tile_cache.py LAT LON RADIUS_KM [OUT_DIR]"""
+    import sys
+    from osm_worker import LAYER_TAGS, merge_tags
+
+    lat, lon, radius_km = (float(a) for a in sys.argv[1:4])
+    cache_dir = sys.argv[4] if len(sys.argv) > 4 else TILE_CACHE_DIR
+    cache = TileCache(merge_tags(LAYER_TAGS), cache_dir=cache_dir, offline_dir="", offline=False)
+    gdf = cache.features((lat, lon), max(1.0, radius_km * 1000.0))
+    print("[tile_cache] {0} features; {hits}/{tiles} tiles already cached, {fetched} fetched into {1}".format(
+        len(gdf), cache.cache_dir, **cache.stats))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,18 @@
 # osm_worker.py - Python 3 OSM downloader for Rhino pipeline
-# Inputs via env: LAT, LON, RADIUS_KM, OUT_DIR
-# Outputs: streets.geojson, buildings.geojson, greens.geojson, DONE.txt/FAILED.txt
+# Inputs via env: LAT, LON, RADIUS_KM, OUT_DIR (optional OSM_EXTRACT: local .osm/.osm.pbf)
+# Outputs: streets/buildings/greens as .parquet (or .fgb) plus .geojson for Rhino, graph.json,
+#          DONE.txt/FAILED.txt
 
 import os
 import sys
 import json
 import time
+import random
+import shutil
+import hashlib
 import traceback
 import subprocess  # moved to top-level to avoid local shadowing
+from concurrent.futures import ThreadPoolExecutor
 
 # Third-party libs (install via requirements.txt): osmnx, geopandas
 import osmnx as ox
@@ -15,6 +20,32 @@ from osmnx.projection import project_gdf
 import geopandas as gpd
 from datetime import datetime
 
+import pandas as pd
+from osm_tile_cache import TileCache
+from osm_extract import ExtractIndex
+import graph_builder
+from job_metrics import JobMetrics, NO_METRICS
+
+
+FETCH_ATTEMPTS = int(os.environ.get("OSM_FETCH_ATTEMPTS", "3"))
+FETCH_BACKOFF_S = float(os.environ.get("OSM_FETCH_BACKOFF_S", "2.0"))  # first retry delay, doubles
+QUERY_MODE = os.environ.get("OSM_QUERY_MODE", "merged")  # "merged" (one Overpass query) | "per_layer"
+TILE_CACHE = os.environ.get("OSM_TILE_CACHE", "1") != "0"  # merged mode: serve overlapping requests from tiles
+OSM_EXTRACT = os.environ.get("OSM_EXTRACT", "")  # local .osm / .osm.pbf used instead of Overpass
+INPROCESS_BUILD = os.environ.get("OSM_INPROCESS_BUILD", "1") != "0"  # "0": graph_builder.py subprocess
+LAYER_FORMAT = os.environ.get("OSM_LAYER_FORMAT", "parquet")  # "parquet" | "fgb" | "none" (GeoJSON only)
+WRITE_GEOJSON = os.environ.get("OSM_WRITE_GEOJSON", "1") != "0"  # only context/osm_importer.py reads it
+
+# Layer tag filters (merged mode ORs them into one query and splits locally)
+LAYER_TAGS = {
+    "streets": {"highway": True},
+    "buildings": {"building": True},
+    "greens": {
+        "leisure": ["park", "garden"],
+        "landuse": ["grass", "recreation_ground", "cemetery"],
+    },
+}
+
 
 def getenv_float(name, default):
     try:
@@ -22,6 +53,261 @@ def getenv_float(name, default):
     except Exception:
         return float(default)
 
+
+class Checkpoints:
+    """
+    Per-stage checkpoints in <job>/_checkpoints so a failed job re-run with the same
+    parameters resumes instead of starting over. Frames are pickled (CRS and index
+    included); params.json guards against resuming with different inputs.
+    """
+
+    def __init__(self, out_dir, params):
+        self.dir = os.path.join(out_dir, "_checkpoints")
+        self.params = params
+        blob = json.dumps(params, sort_keys=True, default=str)
+        self.key = hashlib.sha1(blob.encode("utf-8")).hexdigest()
+        stored = self.load_json("params")
+        if stored is not None and stored.get("key") != self.key:
+            print("Checkpoints are for different parameters; starting over.", flush=True)
+            self.clear()
+        os.makedirs(self.dir, exist_ok=True)
+        if stored is None or stored.get("key") != self.key:
+            self.save_json("params", {"key": self.key, "params": params})
+
+    def _path(self, name, ext):
+        return os.path.join(self.dir, name + ext)
+
+    def load(self, name):
+        path = self._path(name, ".pkl")
+        if not os.path.isfile(path):
+            return None
+        try:
+            gdf = pd.read_pickle(path)
+        except Exception as e:
+            print("Ignoring unreadable checkpoint {0}: {1}".format(name, e), flush=True)
+            return None
+        print("Resuming from checkpoint: {0}".format(name), flush=True)
+        return gdf
+
+    def save(self, name, gdf):
+        tmp = self._path(name, ".pkl.tmp")
+        gdf.to_pickle(tmp)
+        os.replace(tmp, self._path(name, ".pkl"))
+
+    def load_all(self, prefix, names):
+        """{name: gdf} if every '<prefix>.<name>' checkpoint exists, else None."""
+        if not all(os.path.isfile(self._path(prefix + "." + n, ".pkl")) for n in names):
+            return None
+        out = {n: self.load(prefix + "." + n) for n in names}
+        return out if all(g is not None for g in out.values()) else None
+
+    def save_all(self, prefix, gdfs):
+        for n, gdf in gdfs.items():
+            self.save(prefix + "." + n, gdf)
+
+    def load_json(self, name):
+        try:
+            with open(self._path(name, ".json"), "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def save_json(self, name, data):
+        with open(self._path(name, ".json"), "w") as f:
+            json.dump(data, f)
+
+    def clear(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+
+class _NoCheckpoints:
+    def load(self, name):
+        return None
+
+    def save(self, name, gdf):
+        pass
+
+
+def fetch_with_retries(label, fn, *args, **kwargs):
+    """Call fn with exponential backoff (plus jitter) on transient Overpass errors."""
+    delay = FETCH_BACKOFF_S
+    for i in range(FETCH_ATTEMPTS):
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            print("[{0}] fetch attempt {1}/{2} failed: {3}".format(label, i + 1, FETCH_ATTEMPTS, e), flush=True)
+            if i + 1 == FETCH_ATTEMPTS:
+                raise
+            time.sleep(delay * (1.0 + 0.25 * random.random()))
+            delay *= 2.0
+
+
+def download_layers(location_point, dist_m, layer_tags, metrics=NO_METRICS, checkpoints=None):
+    """
+    Fetch every layer concurrently (one thread per layer; the work is Overpass I/O).
+    Returns {name: GeoDataFrame}; each layer is timed as stage "download.<name>" and
+    checkpointed as soon as it arrives, so a retry only fetches the missing layers.
+    """
+    checkpoints = checkpoints or _NoCheckpoints()
+
+    def fetch(name):
+        gdf = checkpoints.load("download." + name)
+        if gdf is not None:
+            return gdf
+        with metrics.stage("download." + name) as rec:
+            print("Downloading {0}...".format(name), flush=True)
+            gdf = fetch_with_retries(name, ox.features_from_point, location_point,
+                                     tags=layer_tags[name], dist=dist_m)
+            rec["features"] = int(len(gdf))
+        checkpoints.save("download." + name, gdf)
+        print("Downloaded {0}: {1} features in {2:.1f} s".format(name, len(gdf), rec["seconds"]), flush=True)
+        return gdf
+
+    with ThreadPoolExecutor(max_workers=len(layer_tags)) as pool:
+        futures = {name: pool.submit(fetch, name) for name in layer_tags}
+        return {name: fut.result() for name, fut in futures.items()}
+
+
+def merge_tags(layer_tags):
+    """Union of the per-layer tag filters (osmnx ORs the keys of one tags dict)."""
+    merged = {}
+    for tags in layer_tags.values():
+        for key, val in tags.items():
+            cur = merged.get(key, [])
+            if cur is True or val is True:
+                merged[key] = True
+                continue
+            for v in (val if isinstance(val, list) else [val]):
+                if v not in cur:
+                    cur = cur + [v]
+            merged[key] = cur
+    return merged
+
+
+def split_layers(gdf, layer_tags):
+    """
+    Split one combined GeoDataFrame back into layers using the same tag filters.
+    Columns that are empty within a layer are dropped, so each layer keeps the
+    properties it would have had from its own query.
+    """
+    out = {}
+    for name, tags in layer_tags.items():
+        mask = None
+        for key, val in tags.items():
+            if key not in gdf.columns:
+                continue
+            m = gdf[key].notna() if val is True else gdf[key].isin(val if isinstance(val, list) else [val])
+            mask = m if mask is None else (mask | m)
+        if mask is None:
+            out[name] = gdf.iloc[0:0]
+            continue
+        sub = gdf[mask]
+        keep = [c for c in sub.columns if c == sub.geometry.name or sub[c].notna().any()]
+        out[name] = sub[keep]
+    return out
+
+
+def download_merged(location_point, dist_m, layer_tags, metrics=NO_METRICS, checkpoints=None):
+    """
+    One Overpass query for all layers; returns the combined GeoDataFrame.
+    With the tile cache on, only tiles not already cached are queried; with
+    OSM_EXTRACT set, the window is read from the local extract's index instead.
+    """
+    checkpoints = checkpoints or _NoCheckpoints()
+    gdf = checkpoints.load("download.merged")
+    if gdf is not None:
+        return gdf
+    tags = merge_tags(layer_tags)
+    with metrics.stage("download") as rec:
+        if OSM_EXTRACT:
+            print("Reading {0} from extract {1}...".format(", ".join(layer_tags), OSM_EXTRACT), flush=True)
+            gdf = ExtractIndex(OSM_EXTRACT, tags).features(location_point, dist_m)
+            rec["source"] = "extract"
+        elif TILE_CACHE:
+            print("Downloading {0} (single query)...".format(", ".join(layer_tags)), flush=True)
+            cache = TileCache(tags, fetcher=lambda bbox, t: fetch_with_retries(
+                "tiles", ox.features_from_bbox, bbox, tags=t))
+            gdf = cache.features(location_point, dist_m)
+            print("Tile cache: {hits}/{tiles} tiles cached, {fetched} fetched".format(**cache.stats), flush=True)
+            rec.update(source="tiles", tiles=dict(cache.stats))
+        else:
+            print("Downloading {0} (single query)...".format(", ".join(layer_tags)), flush=True)
+            gdf = fetch_with_retries("merged", ox.features_from_point, location_point,
+                                     tags=tags, dist=dist_m)
+            rec["source"] = "overpass"
+        rec["features"] = int(len(gdf))
+    checkpoints.save("download.merged", gdf)
+    print("Got {0} features in {1:.2f} s".format(len(gdf), rec["seconds"]), flush=True)
+    return gdf
+
+
+def write_layer(gdf, out_dir, name, metrics=NO_METRICS):
+    """
+    Write one layer in the columnar LAYER_FORMAT (what graph_builder reads) and,
+    if enabled, as GeoJSON for the Rhino importer.
+    """
+    with metrics.stage("layer_write." + name, features=int(len(gdf))):
+        _write_layer(gdf, out_dir, name)
+
+
+def _write_layer(gdf, out_dir, name):
+    if LAYER_FORMAT == "parquet":
+        try:
+            gdf.to_parquet(os.path.join(out_dir, name + ".parquet"))
+        except ImportError:  # pyarrow missing: FlatGeobuf needs only the GDAL/pyogrio stack
+            gdf.to_file(os.path.join(out_dir, name + ".fgb"), driver="FlatGeobuf")
+    elif LAYER_FORMAT == "fgb":
+        gdf.to_file(os.path.join(out_dir, name + ".fgb"), driver="FlatGeobuf")
+    if WRITE_GEOJSON:
+        gdf.to_file(os.path.join(out_dir, name + ".geojson"), driver="GeoJSON")
+
+
+def build_graph_inprocess(out_dir, gdf_streets, gdf_buildings, gdf_greens, metrics=NO_METRICS):
+    """Build graph.json from the projected frames directly (no GeoJSON re-parse)."""
+    log_err = os.path.join(out_dir, "graph_builder_stderr.log")
+    try:
+        t0 = time.time()
+        graph_builder.build_and_export(out_dir, *(graph_builder.gdf_features(g)
+                                                  for g in (gdf_streets, gdf_buildings, gdf_greens)),
+                                       metrics=metrics)
+        graph_builder.mark_graph_done(out_dir)
+        print("Graph built successfully in {0:.1f} s.".format(time.time() - t0), flush=True)
+    except Exception as _e:
+        with open(log_err, "w") as f:
+            f.write(traceback.format_exc())
+        print("Graph build failed (exception): {0}. See {1}".format(_e, log_err), flush=True)
+
+
+def build_graph_subprocess(out_dir):
+    """Legacy path: run graph_builder.py on the written GeoJSON files."""
+    try:
+        # Build graph alongside the OSM exports
+        env = os.environ.copy()
+        env["OUT_DIR"] = out_dir
+        graph_script = os.path.join(os.path.dirname(__file__), "graph_builder.py")
+
+        log_out = os.path.join(out_dir, "graph_builder_stdout.log")
+        log_err = os.path.join(out_dir, "graph_builder_stderr.log")
+
+        with open(log_out, "w") as fout, open(log_err, "w") as ferr:
+            proc = subprocess.Popen(
+                [sys.executable, "-u", graph_script],
+                cwd=os.path.dirname(__file__),
+                env=env,
+                stdout=fout,
+                stderr=ferr
+            )
+            ret = proc.wait()
+
+        if ret == 0 and os.path.exists(os.path.join(out_dir, "graph.json")):
+            print("Graph built successfully.", flush=True)
+        else:
+            print("Graph build failed. See logs:", log_out, log_err, flush=True)
+
+    except Exception as _e:
+        print("Graph build failed (exception): {0}".format(_e), flush=True)
+
+
 def main():
     lat = getenv_float("LAT", 41.3874)
     lon = getenv_float("LON", 2.1686)
@@ -52,49 +338,43 @@ def main():
     location_point = (lat, lon)
     dist_m = max(1.0, radius_km * 1000.0)
 
-    tags_streets = {"highway": True}
-    tags_buildings = {"building": True}
-    tags_greens = {
-        "leisure": ["park", "garden"],
-        "landuse": ["grass", "recreation_ground", "cemetery"],
-    }
+    # A re-run of a failed job resumes from its checkpoints
+    failed_flag = os.path.join(out_dir, "FAILED.txt")
+    if os.path.exists(failed_flag):
+        os.remove(failed_flag)
 
     print("OSM worker starting...", flush=True)
     print("Lat: {0}, Lon: {1}, Radius_km: {2}".format(lat, lon, radius_km), flush=True)
     print("Output dir: {0}".format(out_dir), flush=True)
 
+    metrics = JobMetrics(out_dir)
+    t_job = time.time()
     try:
-        # Retry helper for transient Overpass issues
-        def fetch_with_retries(fn, *args, **kwargs):
-            attempts = 3
-            delay = 5
-            last_exc = None
-            for i in range(attempts):
-                try:
-                    return fn(*args, **kwargs)
-                except Exception as e:
-                    last_exc = e
-                    print("Fetch attempt {0}/{1} failed: {2}".format(i + 1, attempts, e), flush=True)
-                    time.sleep(delay)
-            raise last_exc
-
-        print("Downloading streets...", flush=True)
-        gdf_streets = fetch_with_retries(
-            ox.features_from_point, location_point, tags=tags_streets, dist=dist_m
-        )
-        print("Downloading buildings...", flush=True)
-        gdf_buildings = fetch_with_retries(
-            ox.features_from_point, location_point, tags=tags_buildings, dist=dist_m
-        )
-        print("Downloading green areas...", flush=True)
-        gdf_greens = fetch_with_retries(
-            ox.features_from_point, location_point, tags=tags_greens, dist=dist_m
-        )
-
-        # Project to a metric CRS for consistent geometry operations
-        gdf_streets = project_gdf(gdf_streets)
-        gdf_buildings = project_gdf(gdf_buildings)
-        gdf_greens = project_gdf(gdf_greens)
+        layer_tags = LAYER_TAGS
+        single_query = bool(QUERY_MODE == "merged" or OSM_EXTRACT)
+        checkpoints = Checkpoints(out_dir, {
+            "lat": lat, "lon": lon, "radius_km": radius_km, "merged": single_query,
+            "extract": OSM_EXTRACT, "tags": layer_tags,
+        })
+        recentered = checkpoints.load_all("recentered", layer_tags)
+        gdfs = recentered or checkpoints.load_all("projected", layer_tags)
+        if gdfs is None and single_query:
+            # One round-trip and one projection pass, then split locally
+            gdf_all = download_merged(location_point, dist_m, layer_tags, metrics, checkpoints)
+            with metrics.stage("projection") as rec:
+                gdfs = split_layers(project_gdf(gdf_all), layer_tags)
+                rec.update({name: int(len(gdf)) for name, gdf in gdfs.items()})
+            del gdf_all
+            checkpoints.save_all("projected", gdfs)
+        elif gdfs is None:
+            with metrics.stage("download"):
+                gdfs = download_layers(location_point, dist_m, layer_tags, metrics, checkpoints)
+            # Project to a metric CRS for consistent geometry operations
+            with metrics.stage("projection") as rec:
+                gdfs = {name: project_gdf(gdf) for name, gdf in gdfs.items()}
+                rec.update({name: int(len(gdf)) for name, gdf in gdfs.items()})
+            checkpoints.save_all("projected", gdfs)
+        gdf_streets, gdf_buildings, gdf_greens = gdfs["streets"], gdfs["buildings"], gdfs["greens"]
 
         # Recentering around streets centroid if available; fallback to combined centroid
         def calc_centroid():
@@ -117,9 +397,6 @@ def main():
                 return geom.centroid.coords[0]
             return (0.0, 0.0)
 
-        cx, cy = calc_centroid()
-        print("Recentering to origin using centroid: ({0}, {1})".format(cx, cy), flush=True)
-
         def recenter_gdf(gdf, cx, cy):
             if len(gdf) == 0:
                 return gdf
@@ -128,46 +405,42 @@ def main():
             gdf["geometry"] = gdf["geometry"].translate(-cx, -cy)
             return gdf
 
-        gdf_streets = recenter_gdf(gdf_streets, cx, cy)
-        gdf_buildings = recenter_gdf(gdf_buildings, cx, cy)
-        gdf_greens = recenter_gdf(gdf_greens, cx, cy)
-
-        streets_path = os.path.join(out_dir, "streets.geojson")
-        buildings_path = os.path.join(out_dir, "buildings.geojson")
-        greens_path = os.path.join(out_dir, "greens.geojson")
+        if recentered is None:
+            with metrics.stage("recentering"):
+                cx, cy = calc_centroid()
+                print("Recentering to origin using centroid: ({0}, {1})".format(cx, cy), flush=True)
+                gdf_streets = recenter_gdf(gdf_streets, cx, cy)
+                gdf_buildings = recenter_gdf(gdf_buildings, cx, cy)
+                gdf_greens = recenter_gdf(gdf_greens, cx, cy)
+            checkpoints.save_all("recentered", {
+                "streets": gdf_streets, "buildings": gdf_buildings, "greens": gdf_greens})
+            checkpoints.save_json("centroid", {"cx": cx, "cy": cy, "crs": str(gdf_streets.crs)})
 
-        print("Writing GeoJSON files...", flush=True)
-        gdf_streets.to_file(streets_path, driver="GeoJSON")
-        gdf_buildings.to_file(buildings_path, driver="GeoJSON")
-        gdf_greens.to_file(greens_path, driver="GeoJSON")
-
-        try:
-            # Build graph alongside the OSM exports
-            env = os.environ.copy()
-            env["OUT_DIR"] = out_dir
-            graph_script = os.path.join(os.path.dirname(__file__), "graph_builder.py")
-
-            log_out = os.path.join(out_dir, "graph_builder_stdout.log")
-            log_err = os.path.join(out_dir, "graph_builder_stderr.log")
-
-            with open(log_out, "w") as fout, open(log_err, "w") as ferr:
-                proc = subprocess.Popen(
-                    [sys.executable, "-u", graph_script],
-                    cwd=os.path.dirname(__file__),
-                    env=env,
-                    stdout=fout,
-                    stderr=ferr
-                )
-                ret = proc.wait()
-
-            if ret == 0 and os.path.exists(os.path.join(out_dir, "graph.json")):
-                print("Graph built successfully.", flush=True)
+        layers = (("streets", gdf_streets), ("buildings", gdf_buildings), ("greens", gdf_greens))
+        if INPROCESS_BUILD:
+            # Layers first (in parallel): their content hash is the build cache key. On a
+            # miss the graph is built from the in-memory frames, not re-read from disk.
+            print("Writing layer files...", flush=True)
+            with ThreadPoolExecutor(max_workers=len(layers)) as pool:
+                for fut in [pool.submit(write_layer, gdf, out_dir, name, metrics) for name, gdf in layers]:
+                    fut.result()
+            key, hit = graph_builder.lookup_build_cache(out_dir, metrics)
+            if hit:
+                graph_builder.mark_graph_done(out_dir)
             else:
-                print("Graph build failed. See logs:", log_out, log_err, flush=True)
-
-        except Exception as _e:
-            print("Graph build failed (exception): {0}".format(_e), flush=True)
+                print("Building graph in-process...", flush=True)
+                build_graph_inprocess(out_dir, gdf_streets, gdf_buildings, gdf_greens, metrics)
+                if key and os.path.exists(os.path.join(out_dir, "graph.json")):
+                    graph_builder.store_build_cache(out_dir, key)
+        else:
+            print("Writing layer files...", flush=True)
+            for name, gdf in layers:
+                write_layer(gdf, out_dir, name, metrics)
+            with metrics.stage("graph_subprocess"):
+                build_graph_subprocess(out_dir)
 
+        metrics.set("total", seconds=round(time.time() - t_job, 3))
+        checkpoints.clear()  # job complete; nothing left to resume
         with open(os.path.join(out_dir, "DONE.txt"), "w") as f:
             f.write("ok")
 
@@ -0,0 +1,75 @@
+# context/test_graph_tiled.py
+# The tiled multi-process build must give the same graph as the serial build_graph,
+# whatever the tile size and however the streets cross the tile seams.
+# Run with pytest, or directly: python test_graph_tiled.py
+
+import random
+
+from graph_builder import build_graph, build_graph_tiled, TOLERANCE_M
+
+
+def street_grid(size_m=3000.0, step_m=100.0, jitter_m=0.0, seed=3):
+    """
+    Street grid with one LineString per row/column, vertices every step_m, shifted
+    off the origin so no tile size lines up with it. jitter_m moves every vertex;
+    row and column vertices at the same crossing are jittered independently, so
+    some pairs weld and some do not, and near-tolerance pairs straddle the seams.
+    """
+    rnd = random.Random(seed)
+    n = int(size_m / step_m)
+    off = 13.37
+
+    def j():
+        return rnd.uniform(-jitter_m, jitter_m)
+
+    feats = []
+    for r in range(n + 1):
+        row = [[off + c * step_m + j(), off + r * step_m + j()] for c in range(n + 1)]
+        col = [[off + r * step_m + j(), off + c * step_m + j()] for c in range(n + 1)]
+        for coords in (row, col):
+            feats.append({"type": "Feature", "properties": {},
+                          "geometry": {"type": "LineString", "coordinates": coords}})
+    return {"type": "FeatureCollection", "features": feats}
+
+
+def pois(size_m=3000.0, count=600, seed=5):
+    """Point buildings and square greens scattered over the grid."""
+    rnd = random.Random(seed)
+    buildings, greens = [], []
+    for i in range(count):
+        x, y = rnd.uniform(0, size_m), rnd.uniform(0, size_m)
+        buildings.append({"type": "Feature", "properties": {"id": i, "building": "yes"},
+                          "geometry": {"type": "Point", "coordinates": [x, y]}})
+        if i % 5 == 0:
+            ring = [[x, y], [x + 20, y], [x + 20, y + 20], [x, y + 20], [x, y]]
+            greens.append({"type": "Feature", "properties": {"leisure": "park"},
+                           "geometry": {"type": "Polygon", "coordinates": [ring]}})
+    return ({"type": "FeatureCollection", "features": buildings},
+            {"type": "FeatureCollection", "features": greens})
+
+
+def _same_graph(a, b):
+    assert list(a.nodes(data=True)) == list(b.nodes(data=True))
+    assert list(a.edges(data=True)) == list(b.edges(data=True))
+
+
+def test_tiled_equals_serial_jittered_grid():
+    streets = street_grid(jitter_m=TOLERANCE_M)
+    serial = build_graph(streets, None, None)
+    for tile_m in (500.0, 470.0, 333.3):
+        _same_graph(serial, build_graph_tiled(streets, None, None, tile_m=tile_m, workers=2))
+
+
+def test_tiled_equals_serial_with_pois():
+    streets = street_grid()
+    buildings, greens = pois()
+    for attach_mode in ("vertex", "segment"):
+        serial = build_graph(streets, buildings, greens, attach_mode=attach_mode)
+        tiled = build_graph_tiled(streets, buildings, greens, tile_m=470.0, workers=2, attach_mode=attach_mode)
+        _same_graph(serial, tiled)
+
+
+if __name__ == "__main__":
+    test_tiled_equals_serial_jittered_grid()
+    test_tiled_equals_serial_with_pois()
+    print("[test_graph_tiled] ok")
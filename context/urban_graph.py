@@ -0,0 +1,276 @@
+# context/urban_graph.py
+# Compact array-backed urban graph (CSR adjacency) as an alternative to networkx.
+# Same JSON schema as graph_builder: {"nodes": [{id, x, y, type, ...}], "edges": [{u, v, type, distance, line}]}
+
+import json
+import math
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+# Known type codes first so codes stay stable across files; unknown types are appended
+NODE_TYPES = ("street", "building", "green")
+EDGE_TYPES = ("street", "access")
+
+
+class _Interner:
+    """String <-> small int table."""
+
+    def __init__(self, seed=()):
+        self.names: List[Optional[str]] = []
+        self.codes: Dict[Optional[str], int] = {}
+        for s in seed:
+            self.code(s)
+
+    def code(self, name: Optional[str]) -> int:
+        c = self.codes.get(name)
+        if c is None:
+            c = len(self.names)
+            self.codes[name] = c
+            self.names.append(name)
+        return c
+
+
+class _LazyLines:
+    """Edge polylines as [[x, y], ...] lists, sliced out of the flat coordinate array on access."""
+
+    def __init__(self, off: np.ndarray, xy: np.ndarray):
+        self.off, self.xy = off, xy
+
+    def __len__(self):
+        return len(self.off) - 1
+
+    def __getitem__(self, k):
+        return self.xy[self.off[k]:self.off[k + 1]].tolist()
+
+
+class UrbanGraph:
+    """
+    Undirected graph stored as flat arrays:
+      - node ids interned to int32 indices (ids[i] <-> index[id])
+      - x, y: float64; node_type: int16 codes into node_type_names
+      - edges: eu, ev (int32), edge_type (int16 codes), distance (float64), lines (list)
+      - CSR adjacency: indptr, indices (neighbour), adj_edge (edge index per slot)
+    Extra node/edge attributes are kept as dicts so JSON round-trips are lossless.
+    """
+
+    def __init__(self):
+        self.ids: List[Any] = []
+        self.index: Dict[Any, int] = {}
+        self.x = np.zeros(0, dtype=np.float64)
+        self.y = np.zeros(0, dtype=np.float64)
+        self.node_type = np.zeros(0, dtype=np.int16)
+        self.node_props: List[Dict[str, Any]] = []
+        self.eu = np.zeros(0, dtype=np.int32)
+        self.ev = np.zeros(0, dtype=np.int32)
+        self.edge_type = np.zeros(0, dtype=np.int16)
+        self.distance = np.zeros(0, dtype=np.float64)
+        self.lines: List[Any] = []
+        self.edge_props: List[Dict[str, Any]] = []
+        self.node_type_names: List[Optional[str]] = list(NODE_TYPES)
+        self.edge_type_names: List[Optional[str]] = list(EDGE_TYPES)
+        self.indptr = np.zeros(1, dtype=np.int32)
+        self.indices = np.zeros(0, dtype=np.int32)
+        self.adj_edge = np.zeros(0, dtype=np.int32)
+
+    # ---------------- Construction ----------------
+    @classmethod
+    def from_json(cls, data: Dict[str, Any]) -> "UrbanGraph":
+        """
+        Accepts {edges} or {links}, and 'u'/'v' or 'source'/'target' endpoints.
+        Duplicate edges collapse like nx.Graph (last one wins); missing distances
+        are filled from XY, edges to unknown nodes are skipped.
+        """
+        g = cls()
+        ntypes = _Interner(NODE_TYPES)
+        etypes = _Interner(EDGE_TYPES)
+
+        xs, ys, tcodes = [], [], []
+        for n in (data.get("nodes", []) or []):
+            nid = n.get("id")
+            if nid is None or nid in g.index:
+                continue
+            g.index[nid] = len(g.ids)
+            g.ids.append(nid)
+            x, y = n.get("x"), n.get("y")
+            xs.append(float(x) if x is not None else math.nan)
+            ys.append(float(y) if y is not None else math.nan)
+            tcodes.append(ntypes.code(n.get("type")))
+            g.node_props.append({k: v for k, v in n.items() if k not in ("id", "x", "y", "type")})
+
+        slot: Dict[tuple, int] = {}
+        eu, ev, ecodes, dists = [], [], [], []
+        for e in (data.get("edges") or data.get("links") or []):
+            if not e:
+                continue
+            u = g.index.get(e.get("u", e.get("source")))
+            v = g.index.get(e.get("v", e.get("target")))
+            if u is None or v is None:
+                continue
+            d = e.get("distance")
+            if d is None:
+                d = math.hypot(xs[v] - xs[u], ys[v] - ys[u])
+                if math.isnan(d):
+                    d = 1.0
+            props = {k: val for k, val in e.items()
+                     if k not in ("u", "v", "source", "target", "type", "distance", "line")}
+            key = (u, v) if u <= v else (v, u)
+            i = slot.get(key)
+            if i is None:
+                slot[key] = len(eu)
+                eu.append(u); ev.append(v); ecodes.append(etypes.code(e.get("type")))
+                dists.append(float(d)); g.lines.append(e.get("line")); g.edge_props.append(props)
+            else:
+                eu[i], ev[i] = u, v
+                ecodes[i], dists[i] = etypes.code(e.get("type")), float(d)
+                g.lines[i], g.edge_props[i] = e.get("line"), props
+
+        g.x = np.asarray(xs, dtype=np.float64)
+        g.y = np.asarray(ys, dtype=np.float64)
+        g.node_type = np.asarray(tcodes, dtype=np.int16)
+        g.eu = np.asarray(eu, dtype=np.int32)
+        g.ev = np.asarray(ev, dtype=np.int32)
+        g.edge_type = np.asarray(ecodes, dtype=np.int16)
+        g.distance = np.asarray(dists, dtype=np.float64)
+        g.node_type_names = ntypes.names
+        g.edge_type_names = etypes.names
+        g._build_csr()
+        return g
+
+    @classmethod
+    def from_networkx(cls, G) -> "UrbanGraph":
+        return cls.from_json({
+            "nodes": [{"id": n, **d} for n, d in G.nodes(data=True)],
+            "edges": [{"u": u, "v": v, **d} for u, v, d in G.edges(data=True)],
+        })
+
+    @classmethod
+    def load(cls, path: str) -> "UrbanGraph":
+        with open(path, "r", encoding="utf-8") as f:
+            return cls.from_json(json.load(f))
+
+    @classmethod
+    def from_binary(cls, path: str) -> "UrbanGraph":
+        """
+        Load a graph_binary (.ugb) file. Numeric sections become arrays without parsing;
+        props and edge lines are only decoded for the nodes/edges that are accessed.
+        """
+        from graph_binary import map_graph_binary, LazyProps
+        b = map_graph_binary(path)
+        g = cls()
+        g.ids = b["ids"]
+        g.index = {nid: i for i, nid in enumerate(g.ids)}
+        g.x, g.y = b["x"], b["y"]
+        g.eu, g.ev, g.distance = b["eu"], b["ev"], b["distance"]
+        # -1 (no type) maps to a trailing None entry in the name tables
+        g.node_type_names = b["node_type_names"] + [None]
+        g.edge_type_names = b["edge_type_names"] + [None]
+        g.node_type = np.where(b["node_type"] < 0, len(g.node_type_names) - 1, b["node_type"]).astype(np.int16)
+        g.edge_type = np.where(b["edge_type"] < 0, len(g.edge_type_names) - 1, b["edge_type"]).astype(np.int16)
+        g.node_props = LazyProps(b["node_props"])
+        g.edge_props = LazyProps(b["edge_props"])
+        g.lines = _LazyLines(b["line_off"], b["line_xy"])
+        g._build_csr()
+        return g
+
+    @classmethod
+    def load_any(cls, json_path: str) -> "UrbanGraph":
+        """
+        Prefer the fresh binary companion of json_path; falls back to the JSON when there
+        is none or it cannot be read (truncated, corrupt or a newer format version).
+        """
+        from graph_binary import fresh_binary_path
+        bin_path = fresh_binary_path(json_path)
+        if bin_path:
+            try:
+                return cls.from_binary(bin_path)
+            except Exception:
+                pass
+        return cls.load(json_path)
+
+    def _build_csr(self):
+        n, m = len(self.ids), len(self.eu)
+        loops = self.eu == self.ev
+        # Both directions per edge, self-loops once
+        src = np.concatenate([self.eu, self.ev[~loops]])
+        dst = np.concatenate([self.ev, self.eu[~loops]])
+        eid = np.concatenate([np.arange(m, dtype=np.int32), np.nonzero(~loops)[0].astype(np.int32)])
+        order = np.argsort(src, kind="stable")
+        self.indices = dst[order].astype(np.int32)
+        self.adj_edge = eid[order].astype(np.int32)
+        counts = np.bincount(src, minlength=n)
+        self.indptr = np.zeros(n + 1, dtype=np.int32)
+        np.cumsum(counts, out=self.indptr[1:])
+
+    # ---------------- Queries ----------------
+    @property
+    def number_of_nodes(self) -> int:
+        return len(self.ids)
+
+    @property
+    def number_of_edges(self) -> int:
+        return len(self.eu)
+
+    def type_code(self, name: str, edge: bool = False) -> int:
+        """Code for a type name, or -1 if the graph has none of that type."""
+        names = self.edge_type_names if edge else self.node_type_names
+        return names.index(name) if name in names else -1
+
+    def degree(self) -> np.ndarray:
+        return np.diff(self.indptr)
+
+    def neighbors(self, i: int) -> np.ndarray:
+        return self.indices[self.indptr[i]:self.indptr[i + 1]]
+
+    def node_attrs(self, i: int) -> Dict[str, Any]:
+        """Node attributes as the networkx/JSON dict (without id); absent keys stay absent."""
+        d = {}
+        if not math.isnan(self.x[i]):
+            d["x"] = float(self.x[i])
+        if not math.isnan(self.y[i]):
+            d["y"] = float(self.y[i])
+        t = self.node_type_names[self.node_type[i]]
+        if t is not None:
+            d["type"] = t
+        d.update(self.node_props[i])
+        return d
+
+    def edge_attrs(self, k: int) -> Dict[str, Any]:
+        d = {}
+        t = self.edge_type_names[self.edge_type[k]]
+        if t is not None:
+            d["type"] = t
+        d["distance"] = float(self.distance[k])
+        if self.lines[k] is not None:
+            d["line"] = self.lines[k]
+        d.update(self.edge_props[k])
+        return d
+
+    def to_scipy(self, edge_mask: Optional[np.ndarray] = None):
+        """
+        Symmetric scipy.sparse.csr_matrix weighted by distance. Without a mask the
+        CSR index arrays are shared, not copied. edge_mask keeps a subset of edges.
+        """
+        from scipy.sparse import csr_matrix
+        n = len(self.ids)
+        data = self.distance[self.adj_edge]
+        if edge_mask is None:
+            return csr_matrix((data, self.indices, self.indptr), shape=(n, n), copy=False)
+        keep = edge_mask[self.adj_edge]
+        indptr = np.concatenate([[0], np.cumsum(keep, dtype=np.int32)])[self.indptr]
+        return csr_matrix((data[keep], self.indices[keep], indptr), shape=(n, n), copy=False)
+
+    # ---------------- Export ----------------
+    def to_json(self) -> Dict[str, Any]:
+        nodes = [{"id": nid, **self.node_attrs(i)} for i, nid in enumerate(self.ids)]
+        edges = [{"u": self.ids[self.eu[k]], "v": self.ids[self.ev[k]], **self.edge_attrs(k)}
+                 for k in range(len(self.eu))]
+        return {"nodes": nodes, "edges": edges}
+
+    def to_networkx(self):
+        import networkx as nx
+        G = nx.Graph()
+        G.add_nodes_from((nid, self.node_attrs(i)) for i, nid in enumerate(self.ids))
+        G.add_edges_from((self.ids[self.eu[k]], self.ids[self.ev[k]], self.edge_attrs(k))
+                         for k in range(len(self.eu)))
+        return G
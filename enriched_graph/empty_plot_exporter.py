@@ -16,6 +16,7 @@ Output:
 
 import os
 import io
+import sys
 import json
 import time
 import re
@@ -27,6 +28,15 @@ OSM_ROOT = os.path.join(KNOWLEDGE_DIR, "osm")
 MERGE_DIR = os.path.join(KNOWLEDGE_DIR, "merge")
 OUT_PATH = os.path.join(MERGE_DIR, "empty_plot_graph.json")
 
+# Binary graph companions (context/graph_binary.py); JSON remains the fallback
+CONTEXT_DIR = os.path.join(PROJECT_DIR, "context")
+if CONTEXT_DIR not in sys.path:
+    sys.path.append(CONTEXT_DIR)
+try:
+    from graph_binary import read_graph_binary, fresh_binary_path
+except Exception:
+    read_graph_binary = None
+
 # ----------------- I/O helpers -----------------
 
 def _ensure_dir(p):
@@ -130,6 +140,18 @@ def _load_json_robust(path, label):
             raise RuntimeError("Failed to parse %s at %s: %s" % (label, path, str(e2)))
 
 
+def _load_graph_robust(path, label):
+    """graph.json loader that prefers the fresh binary companion (graph_binary.py)."""
+    if read_graph_binary is not None:
+        bpath = fresh_binary_path(path)
+        if bpath:
+            try:
+                return read_graph_binary(bpath)
+            except Exception:
+                pass
+    return _load_json_robust(path, label)
+
+
 # ----------------- Normalization / geometry helpers -----------------
 
 def _normalize_graph(raw):
@@ -394,7 +416,7 @@ def build(job_dir=None):
     gpath = os.path.join(job_dir, "graph.json")
 
     boundary_xy = _load_json_robust(bpath, "boundary.json")
-    raw = _load_json_robust(gpath, "original graph.json")
+    raw = _load_graph_robust(gpath, "original graph.json")
     G = _normalize_graph(raw)
 
     # Partition nodes by boundary
@@ -17,7 +17,7 @@ Output:
   - knowledge/merge/masterplan_graph.json
 """
 
-import os, json, time, math, re, tempfile
+import os, sys, json, time, math, re, tempfile
 
 # ---------------- Configuration ----------------
 # Max distance (in the same XY units as your graphs) to attach connectors.
@@ -46,6 +46,15 @@ EMPTY_PLOT_PATH = os.path.join(MERGE_DIR, "empty_plot_graph.json")
 ENRICHED_PATH = os.path.join(KNOWLEDGE_DIR, "enriched", "enriched_graph.json")
 OUT_PATH = os.path.join(MERGE_DIR, "masterplan_graph.json")
 
+# Binary graph companions (context/graph_binary.py); JSON remains the fallback
+CONTEXT_DIR = os.path.join(PROJECT_DIR, "context")
+if CONTEXT_DIR not in sys.path:
+    sys.path.append(CONTEXT_DIR)
+try:
+    from graph_binary import read_graph_binary, fresh_binary_path
+except Exception:
+    read_graph_binary = None
+
 # ---------------- I/O utils ----------------
 def _ensure_dir(p):
     try:
@@ -145,6 +154,18 @@ def _load_json_robust(path, label, retries=5, wait=0.25):
             raise RuntimeError("Failed to parse %s at %s (salvaged): %s" % (label, path, str(e3)))
     raise RuntimeError("Failed to parse %s at %s: Expecting valid single JSON object/array" % (label, path))
 
+
+def _load_graph_robust(path, label):
+    """graph.json loader that prefers the fresh binary companion (graph_binary.py)."""
+    if read_graph_binary is not None:
+        bpath = fresh_binary_path(path)
+        if bpath:
+            try:
+                return read_graph_binary(bpath)
+            except Exception:
+                pass
+    return _load_json_robust(path, label)
+
 def _atomic_write_json(path, data):
     """Windows/IronPython-safe UTF-8 atomic-ish write."""
     _ensure_dir(os.path.dirname(path))
@@ -317,7 +338,7 @@ def _compute_connectors_from_original(job_dir, boundary_xy):
     These are the "connectors" we need to reattach.
     """
     gpath = os.path.join(job_dir, "graph.json")
-    raw = _load_json_robust(gpath, "original OSM graph.json")
+    raw = _load_graph_robust(gpath, "original OSM graph.json")
     G = _normalize_graph(raw)
 
     inside, outside = set(), set()
@@ -20,6 +20,7 @@ import traceback
 from datetime import datetime, timezone
 
 import networkx as nx
+import numpy as np
 
 try:
     # Polygon kept for compatibility; boundary is not used
@@ -34,6 +35,20 @@ except Exception:
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
 PROJECT_ROOT = os.path.abspath(os.path.join(CURRENT_DIR, ".."))
 
+# Array-backed graph (context/urban_graph.py), used unless GRAPH_BACKEND=networkx or
+# SciPy is missing; both backends give the same KPIs
+sys.path.append(os.path.join(PROJECT_ROOT, "context"))
+try:
+    from urban_graph import UrbanGraph
+    from scipy.sparse.csgraph import dijkstra
+except Exception:
+    UrbanGraph = None
+try:
+    from graph_binary import load_graph  # prefers a fresh .ugb companion over the JSON
+except Exception:
+    load_graph = None
+GRAPH_BACKEND = os.environ.get("GRAPH_BACKEND", "csr")  # "csr" | "networkx"
+
 # Default directories
 DEFAULT_ITERATION_DIR = os.path.join(PROJECT_ROOT, "knowledge", "iteration")
 DEFAULT_INPUT_JSON = os.path.join(DEFAULT_ITERATION_DIR, "it1.json")
@@ -308,6 +323,105 @@ def _compute_kpi_street_anchor(G: nx.Graph, typed_map: dict, cutoff_m: float):
     avg = (score_sum / max(1, pair_count)) if pair_count > 0 else 0.0
     return avg, pair_count, paths_found
 
+# -----------------------------
+# KPI on the CSR graph (default backend) – same results, no networkx
+# -----------------------------
+_DIJKSTRA_CELLS = 8_000_000  # rows*cols of each batched distance matrix
+
+def _typed_nodes_csr(UG):
+    """Return dict {node_index: category} for all typed nodes in the graph."""
+    typed = {}
+    for i in range(UG.number_of_nodes):
+        cat = _categorize_node(UG.node_attrs(i))
+        if cat in NODE_WEIGHTS:
+            typed[i] = cat
+    return typed
+
+def _batched_dists(M, sources, targets, cutoff_m):
+    """{(s, t): d} for finite shortest paths from each source to each target."""
+    out = {}
+    if not sources or not targets:
+        return out
+    cols = np.asarray(targets)
+    step = max(1, _DIJKSTRA_CELLS // max(1, M.shape[0]))
+    for k in range(0, len(sources), step):
+        rows = sources[k:k + step]
+        D = dijkstra(M, directed=False, indices=rows, limit=max(0.0, cutoff_m))[:, cols]
+        ri, ci = np.nonzero(np.isfinite(D))
+        for r, c in zip(ri.tolist(), ci.tolist()):
+            out[(rows[r], targets[c])] = float(D[r, c])
+    return out
+
+def _compute_kpi_typed_csr(UG, typed_map: dict, cutoff_m: float):
+    T = sorted(typed_map.keys())
+    if len(T) < 2:
+        return 0.0, 0, 0
+    dists = _batched_dists(UG.to_scipy(), T, T, cutoff_m)
+
+    score_sum = 0.0
+    pair_count = 0
+    for i, u in enumerate(T):
+        for v in T[i+1:]:
+            d = dists.get((u, v))
+            if d is None or d <= 0:
+                continue
+            cu, cv = typed_map[u], typed_map[v]
+            score_sum += (NODE_WEIGHTS[cu] * NODE_WEIGHTS[cv] * COMPATIBILITY[cu][cv]) / float(d)
+            pair_count += 1
+
+    avg = (score_sum / max(1, pair_count)) if pair_count > 0 else 0.0
+    return avg, pair_count, pair_count
+
+def _compute_kpi_street_anchor_csr(UG, typed_map: dict, cutoff_m: float):
+    T = sorted(typed_map.keys())
+    if len(T) < 2:
+        return 0.0, 0, 0
+
+    street = UG.type_code("street")
+    is_street = UG.node_type == street
+
+    # Anchor selection (typed node -> nearest connected street via its access edge)
+    anchor = {}
+    access_len = {}
+    for n in T:
+        lo, hi = UG.indptr[n], UG.indptr[n + 1]
+        nbrs = UG.indices[lo:hi]
+        ok = is_street[nbrs]
+        if not ok.any():
+            continue
+        d = UG.distance[UG.adj_edge[lo:hi]][ok]
+        k = int(np.argmin(d))
+        anchor[n] = int(nbrs[ok][k])
+        access_len[n] = float(d[k])
+
+    T = [n for n in T if n in anchor]
+    if len(T) < 2:
+        return 0.0, 0, 0
+
+    # Distances between anchors on the street-only subgraph
+    S = UG.to_scipy(is_street[UG.eu] & is_street[UG.ev])
+    unique_anchors = sorted(set(anchor[n] for n in T))
+    anchor_dists = _batched_dists(S, unique_anchors, unique_anchors, cutoff_m)
+
+    score_sum = 0.0
+    pair_count = 0
+    for i, u in enumerate(T):
+        au = anchor[u]
+        acc_u = access_len[u]
+        for v in T[i+1:]:
+            ds = anchor_dists.get((au, anchor[v]))
+            if ds is None:
+                continue
+            d = acc_u + ds + access_len[v]
+            if d <= 0:
+                continue
+            cu, cv = typed_map[u], typed_map[v]
+            score_sum += (NODE_WEIGHTS[cu] * NODE_WEIGHTS[cv] * COMPATIBILITY[cu][cv]) / float(d)
+            pair_count += 1
+
+    avg = (score_sum / max(1, pair_count)) if pair_count > 0 else 0.0
+    return avg, pair_count, pair_count
+
 # -----------------------------
 # Normalization helpers (1–100)
 # -----------------------------
@@ -363,19 +477,29 @@ def process_one_graph(graph_path, out_dir):
     try:
         t_all0 = time.time()
 
-        graph_json = _load_json(graph_path)
-        G = _build_graph_from_json(graph_json)
+        use_csr = GRAPH_BACKEND == "csr" and UrbanGraph is not None
+        if use_csr:
+            G = UrbanGraph.load_any(graph_path)
+            xs = G.x[~np.isnan(G.x)].tolist()
+            ys = G.y[~np.isnan(G.y)].tolist()
+            typed_fn, anchor_fn, kpi_typed_fn = _typed_nodes_csr, _compute_kpi_street_anchor_csr, _compute_kpi_typed_csr
+            total_nodes, total_edges = G.number_of_nodes, G.number_of_edges
+        else:
+            graph_json = load_graph(graph_path) if load_graph is not None else _load_json(graph_path)
+            G = _build_graph_from_json(graph_json)
+            xs = [d.get("x") for _, d in G.nodes(data=True) if d.get("x") is not None]
+            ys = [d.get("y") for _, d in G.nodes(data=True) if d.get("y") is not None]
+            typed_fn, anchor_fn, kpi_typed_fn = _typed_nodes_all, _compute_kpi_street_anchor, _compute_kpi_typed
+            total_nodes, total_edges = G.number_of_nodes(), G.number_of_edges()
 
         # Area from bounding box (m^2 -> km^2)
-        xs = [d.get("x") for _, d in G.nodes(data=True) if d.get("x") is not None]
-        ys = [d.get("y") for _, d in G.nodes(data=True) if d.get("y") is not None]
         if len(xs) >= 2 and len(ys) >= 2:
             area_km2 = max(0.0, (max(xs) - min(xs)) * (max(ys) - min(ys)) / 1e6)
         else:
             area_km2 = 0.0
 
         # Typed nodes across the whole graph (no boundary filter)
-        typed_inside = _typed_nodes_all(G)
+        typed_inside = typed_fn(G)
         inside_typed_ids = list(typed_inside.keys())
         typed_N = len(inside_typed_ids)
         cat_counts = _counts_for(inside_typed_ids, typed_inside)
@@ -384,13 +508,13 @@ def process_one_graph(graph_path, out_dir):
         # KPI fast path + fallback
         method_used = "street_anchor"
         t0 = time.time()
-        avg, pairs, paths = _compute_kpi_street_anchor(G, typed_inside, CUTOFF_M)
+        avg, pairs, paths = anchor_fn(G, typed_inside, CUTOFF_M)
         elapsed = time.time() - t0
 
         fallback_used = False
         if (typed_N < MIN_TYPED) or (typed_per_km2 < MIN_TYPED_PER_KM2):
             t1 = time.time()
-            avg2, pairs2, paths2 = _compute_kpi_typed(G, typed_inside, CUTOFF_M)
+            avg2, pairs2, paths2 = kpi_typed_fn(G, typed_inside, CUTOFF_M)
             elapsed = time.time() - t1
             avg, pairs, paths = avg2, pairs2, paths2
             method_used = "typed"
@@ -414,12 +538,13 @@ def process_one_graph(graph_path, out_dir):
             "input_path": graph_path,
             "timestamp": datetime.now(timezone.utc).isoformat().replace("+00:00", "Z"),
             "method": method_used,
+            "graph_backend": "csr" if use_csr else "networkx",
             "fallback_used": fallback_used,
             "cutoff_m": CUTOFF_M,
             "bands_x1000": BANDS,
             "stats": {
-                "total_nodes": G.number_of_nodes(),
-                "total_edges": G.number_of_edges(),
+                "total_nodes": total_nodes,
+                "total_edges": total_edges,
                 "area_km2": area_km2,
                 "typed_nodes_inside": typed_N,
                 "typed_density_per_km2": typed_per_km2,
@@ -2,6 +2,7 @@
 # Run with Python 3 (launched by main.py via an external interpreter).
 # - Deletes knowledge/massing_graph.json
 # - Deletes knowledge/osm/graph_context.json
+#   (and the graph_binary .ugb companions of both)
 # - Purges knowledge/osm temporary workspaces:
 #     * folders named "_tmp"
 #     * folders starting with "osm_"
@@ -12,11 +13,15 @@
 
 import os
 import re
+import sys
 import stat
 import shutil
 from pathlib import Path
 from typing import Iterable
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "context"))
+from graph_binary import binary_path_for
+
 # -------- Helpers --------
 
 UUID_RX = re.compile(r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$", re.I)
@@ -109,10 +114,11 @@ def purge_osm_workspaces(osm_dir: Path) -> None:
 
 def remove_known_files(knowledge_dir: Path) -> None:
     """Remove individual files that should not persist across sessions."""
-    targets = [
+    graphs = [
         knowledge_dir / "massing_graph.json",
         knowledge_dir / "osm" / "graph_context.json",
     ]
+    targets = graphs + [Path(binary_path_for(str(g))) for g in graphs]
     for t in targets:
         if t.exists() and t.is_file():
             safe_remove_file(t)
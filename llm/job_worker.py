@@ -0,0 +1,94 @@
+# job_worker.py - long-lived worker process for the job pool in llm.py
+# Imports the heavy geo stack once, then runs worker scripts (osm_worker.py,
+# eval_worker.py) one at a time, each as if started with `python script.py`.
+#
+# Protocol (one JSON object per line):
+#   stdin   {"id": ..., "script": <path>, "env": {...}}     one job
+#   stdout  {"ready": true}                                  once, after warm-up
+#           {"id": ..., "ok": bool, "error": str|null}       one per job
+# Everything the scripts print goes to stderr (the server console).
+
+import os
+import sys
+import json
+import time
+import runpy
+import traceback
+
+PROJECT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+WARM_MODULES = ("numpy", "pandas", "scipy", "shapely", "networkx", "pyproj", "geopandas", "osmnx")
+
+
+def warm_up():
+    t0 = time.time()
+    loaded = []
+    for name in WARM_MODULES:
+        try:
+            __import__(name)
+            loaded.append(name)
+        except Exception:
+            pass
+    print("[job_worker {0}] Warm in {1:.1f} s ({2})".format(os.getpid(), time.time() - t0, ", ".join(loaded)),
+          flush=True)
+
+
+def _drop_project_modules(keep):
+    """Forget project modules a job imported so the next job runs fresh code;
+    third-party modules stay loaded (that is the point of a warm worker)."""
+    for name in set(sys.modules) - keep:
+        path = getattr(sys.modules[name], "__file__", None) or ""
+        if path and os.path.abspath(path).startswith(PROJECT_DIR + os.sep) and "site-packages" not in path:
+            del sys.modules[name]
+
+
+def run_script(script, env):
+    """Run script as __main__ with env applied; returns (ok, error)."""
+    saved_env, saved_path, saved_argv, saved_cwd = dict(os.environ), list(sys.path), list(sys.argv), os.getcwd()
+    saved_modules = set(sys.modules)
+    os.environ.update(env)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(script)))
+    sys.argv = [script]
+    try:
+        runpy.run_path(script, run_name="__main__")
+        return True, None
+    except SystemExit as e:
+        if e.code in (None, 0):
+            return True, None
+        return False, "exit code {0}".format(e.code)
+    except BaseException as e:
+        traceback.print_exc()
+        return False, "{0}: {1}".format(type(e).__name__, e)
+    finally:
+        os.environ.clear()
+        os.environ.update(saved_env)
+        sys.path[:] = saved_path
+        sys.argv = saved_argv
+        os.chdir(saved_cwd)
+        _drop_project_modules(saved_modules)
+
+
+def main():
+    # Keep the original stdout for the protocol; route all other output to stderr
+    proto = os.fdopen(os.dup(sys.stdout.fileno()), "w", encoding="utf-8")
+    sys.stdout.flush()
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+    def reply(obj):
+        proto.write(json.dumps(obj) + "\n")
+        proto.flush()
+
+    warm_up()
+    reply({"ready": True})
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+        job = json.loads(line)
+        ok, error = run_script(job["script"], job.get("env") or {})
+        sys.stdout.flush()
+        sys.stderr.flush()
+        reply({"id": job.get("id"), "ok": ok, "error": error})
+
+
+if __name__ == "__main__":
+    main()
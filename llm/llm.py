@@ -1,7 +1,12 @@
-import os, sys, io, re, json, csv, glob, uuid, shutil, subprocess
+import os, sys, io, re, json, csv, glob, time, uuid, shutil, subprocess, asyncio, hashlib, unicodedata, threading
 import requests, PyPDF2, uvicorn, logging
 
-from collections import defaultdict
+try:
+    import httpx  # async client with keep-alive pooling; falls back to requests on a thread
+except Exception:
+    httpx = None
+
+from collections import defaultdict, deque
 from datetime import datetime
 from pathlib import Path
 from typing import Dict
@@ -9,7 +14,8 @@ from typing import Dict
 from fastapi import FastAPI, Request, UploadFile, File, Form
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse, Response
+from starlette.concurrency import run_in_threadpool
 
 # ---- Project config ----
 sys.path.append(str(Path(__file__).resolve().parent.parent))
@@ -25,12 +31,18 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag"],
 )
 
 # ----------------------------
 # Constants / Paths
 # ----------------------------
 LM_STUDIO_URL = "http://localhost:1234/v1/chat/completions"
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", "2"))  # generations in flight
+LLM_CONNECT_TIMEOUT = 5.0
+LM_MODELS_URL = "http://localhost:1234/v1/models"
+LM_MODEL = os.environ.get("LM_STUDIO_MODEL", "lmstudio")  # model id sent to LM Studio ("lmstudio": whatever is loaded)
+LM_MODEL_TTL_S = 30.0  # how long a /v1/models answer is trusted
 
 BASE_DIR = Path(__file__).resolve().parent  # .../llm
 PROJECT_DIR = BASE_DIR.parent               # project root
@@ -44,6 +56,13 @@ ENRICHED_FILE = KNOWLEDGE_DIR / "enriched" / "enriched_graph.json"
 for d in (RUNTIME_DIR, OSM_DIR, BRIEFS_DIR):
     os.makedirs(d, exist_ok=True)
 
+# Binary graph companions written by graph_builder (context/graph_binary.py)
+sys.path.append(str(CONTEXT_DIR))
+try:
+    from graph_binary import load_graph
+except Exception:
+    load_graph = None
+
 # --- Massing graph endpoints ---
 REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 GRAPH_PATH = os.path.join(REPO_ROOT, "knowledge", "massing_graph.json")
@@ -62,6 +81,130 @@ stored_brief: str = ""
 # Track last OSM workspace so we can purge it before creating a new one
 LAST_JOB_MARK = OSM_DIR / "_last_job.txt"
 
+# Brief -> graph results, keyed by normalized brief text + prompt version + the id of
+# the model that actually served the request (not the LM_MODEL placeholder).
+# Lives outside brief_* folders so it survives the per-upload purge.
+BRIEF_CACHE_DIR = BRIEFS_DIR / "_cache"
+BRIEF_CACHE = os.environ.get("BRIEF_CACHE", "1") != "0"
+BRIEF_PROMPT_VERSION = "1"  # bump whenever the brief-to-graph prompt or payload changes
+
+# ----------------------------
+# LM Studio client (shared, non-blocking)
+# ----------------------------
+_llm_client = None
+_llm_slots = None
+_lm_model_seen = (None, 0.0)  # (model id, monotonic time it was learned)
+
+
+def _llm_state():
+    """Lazily create the pooled client and concurrency gate on the server's event loop."""
+    global _llm_client, _llm_slots
+    if _llm_slots is None:
+        _llm_slots = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+    if _llm_client is None and httpx is not None:
+        _llm_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=LLM_MAX_CONCURRENCY * 2,
+                                max_keepalive_connections=LLM_MAX_CONCURRENCY),
+            timeout=httpx.Timeout(60.0, connect=LLM_CONNECT_TIMEOUT),
+        )
+    return _llm_client, _llm_slots
+
+
+async def lm_chat(payload: dict, timeout: float = 60.0) -> dict:
+    """
+    POST a chat completion to LM Studio without blocking the event loop.
+    At most LLM_MAX_CONCURRENCY requests run at once; the rest wait their turn.
+    Raises on HTTP/transport errors like requests.raise_for_status().
+    """
+    client, slots = _llm_state()
+    async with slots:
+        if client is not None:
+            res = await client.post(LM_STUDIO_URL, json=payload, timeout=timeout)
+            res.raise_for_status()
+            return res.json()
+
+        def _post():
+            r = requests.post(LM_STUDIO_URL, json=payload, timeout=timeout)
+            r.raise_for_status()
+            return r.json()
+        return await run_in_threadpool(_post)
+
+
+async def lm_model_id() -> str | None:
+    """
+    Id of the model LM Studio will answer with: LM_STUDIO_MODEL when set, else the first
+    model listed by /v1/models (remembered for LM_MODEL_TTL_S). None if it cannot be told.
+    """
+    global _lm_model_seen
+    if "LM_STUDIO_MODEL" in os.environ:
+        return LM_MODEL
+    model, seen = _lm_model_seen
+    if model and time.monotonic() - seen < LM_MODEL_TTL_S:
+        return model
+    client, _ = _llm_state()
+    try:
+        if client is not None:
+            res = await client.get(LM_MODELS_URL, timeout=LLM_CONNECT_TIMEOUT)
+            res.raise_for_status()
+            data = res.json()
+        else:
+            data = await run_in_threadpool(lambda: requests.get(LM_MODELS_URL, timeout=LLM_CONNECT_TIMEOUT).json())
+        model = (data.get("data") or [{}])[0].get("id")
+    except Exception as e:
+        print("[lm_studio] Could not list models:", e)
+        return None
+    if model:
+        _lm_model_seen = (model, time.monotonic())
+    return model
+
+
+async def lm_chat_stream(payload: dict, timeout: float = 60.0):
+    """
+    Async generator of content deltas for a streamed chat completion (OpenAI-style
+    SSE from LM Studio). Holds a concurrency slot until the stream ends. Without
+    httpx the reply is fetched in one piece and yielded once.
+    """
+    payload = dict(payload, stream=True)
+    client, slots = _llm_state()
+    async with slots:
+        if client is None:
+            def _post():
+                r = requests.post(LM_STUDIO_URL, json=dict(payload, stream=False), timeout=timeout)
+                r.raise_for_status()
+                return r.json()
+            res = await run_in_threadpool(_post)
+            yield res["choices"][0]["message"]["content"]
+            return
+
+        async with client.stream("POST", LM_STUDIO_URL, json=payload, timeout=timeout) as res:
+            res.raise_for_status()
+            async for line in res.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                try:
+                    choice = json.loads(data)["choices"][0]
+                except (ValueError, KeyError, IndexError):
+                    continue
+                delta = (choice.get("delta") or {}).get("content")
+                if delta:
+                    yield delta
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.on_event("shutdown")
+async def _close_llm_client():
+    global _llm_client
+    if _llm_client is not None:
+        await _llm_client.aclose()
+        _llm_client = None
+
+
 # ----------------------------
 # Small helpers
 # ----------------------------
@@ -147,6 +290,23 @@ def _purge_previous_osm_workspace():
         pass
 
 
+def _resumable_osm_job(params):
+    """
+    Last job folder if it failed with the same lat/lon/radius and left checkpoints
+    behind (osm_worker validates the remaining parameters itself), else None.
+    """
+    try:
+        prev = Path(LAST_JOB_MARK.read_text(encoding="utf-8").strip())
+    except Exception:
+        return None
+    if not (prev / "FAILED.txt").exists() or not (prev / "_checkpoints").is_dir():
+        return None
+    job = _read_json(prev / "job.json") or {}
+    if all(job.get(k) == v for k, v in params.items()):
+        return prev
+    return None
+
+
 # ============================
 # GREETING endpoint
 # ============================
@@ -164,10 +324,9 @@ async def initial_greeting(test: bool = False):
     )
 
     try:
-        res = requests.post(
-            LM_STUDIO_URL,
-            json={
-                "model": "lmstudio",
+        res = await lm_chat(
+            {
+                "model": LM_MODEL,
                 "messages": [
                     {"role": "system", "content": sys_msg},
                     {"role": "user", "content": "Please greet me now."},
@@ -179,8 +338,7 @@ async def initial_greeting(test: bool = False):
             },
             timeout=10,
         )
-        res.raise_for_status()
-        greeting = res.json()["choices"][0]["message"]["content"].strip()
+        greeting = res["choices"][0]["message"]["content"].strip()
 
         bad_bits = ("use", "need", "instruction", "one sentence", "at least one", "output only")
         if len(greeting.split()) < 4 or any(b in greeting.lower() for b in bad_bits):
@@ -202,11 +360,8 @@ async def initial_greeting(test: bool = False):
 # ============================
 # CHAT endpoint
 # ============================
-@app.post("/chat")
-async def chat(request: Request):
-    data = await request.json()
-    user_message = data.get("message", "")
-
+def _chat_payload(user_message: str) -> dict:
+    """LM Studio payload for a chat turn: system prompt, brief and massing context, user message."""
     messages = [
         {"role": "system", "content": """
 You are Graph Copilot for an urban design project.
@@ -250,20 +405,24 @@ When helpful, format replies in Markdown (bold, lists, short headings).
         })
     messages.append({"role": "user", "content": user_message})
 
-    try:
-        lmstudio_payload = {
-            "model": "lmstudio",
-            "messages": messages,
-            "stream": False,
-            "temperature": 0.3, # concise
-            "top_p": 0.9,
-            "max_tokens": 500,
-            "stop": ["User:", "Assistant:", "System:"],
-        }
+    return {
+        "model": LM_MODEL,
+        "messages": messages,
+        "stream": False,
+        "temperature": 0.3, # concise
+        "top_p": 0.9,
+        "max_tokens": 500,
+        "stop": ["User:", "Assistant:", "System:"],
+    }
+
 
-        res = requests.post(LM_STUDIO_URL, json=lmstudio_payload, timeout=30)
-        res.raise_for_status()
-        lmstudio_response = res.json()
+@app.post("/chat")
+async def chat(request: Request):
+    data = await request.json()
+    lmstudio_payload = _chat_payload(data.get("message", ""))
+
+    try:
+        lmstudio_response = await lm_chat(lmstudio_payload, timeout=30)
         assistant_reply = lmstudio_response["choices"][0]["message"]["content"].strip()
 
         return {"response": assistant_reply}
@@ -271,11 +430,37 @@ When helpful, format replies in Markdown (bold, lists, short headings).
     except Exception as e:
         return {"error": str(e), "response": "Failed to reach LM Studio."}
 
+
+@app.post("/chat/stream")
+async def chat_stream(request: Request):
+    """
+    Same as /chat, but the reply is sent as Server-Sent Events while LM Studio generates it:
+      event: token  data: {"delta": "..."}
+      event: done   data: {"response": "<full reply>"}
+      event: error  data: {"error": "...", "response": "Failed to reach LM Studio."}
+    """
+    data = await request.json()
+    lmstudio_payload = _chat_payload(data.get("message", ""))
+
+    async def events():
+        parts = []
+        try:
+            async for delta in lm_chat_stream(lmstudio_payload, timeout=30):
+                parts.append(delta)
+                yield _sse("token", {"delta": delta})
+            yield _sse("done", {"response": "".join(parts).strip()})
+        except Exception as e:
+            yield _sse("error", {"error": str(e), "response": "Failed to reach LM Studio."})
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 # ============================
 # BRIEF upload endpoint
 # ============================
 @app.post("/upload_brief")
-async def upload_brief(file: UploadFile = File(None), text: str = Form(None)):
+async def upload_brief(file: UploadFile = File(None), text: str = Form(None), refresh: bool = Form(False)):
+    """refresh=true skips the brief-graph cache and re-runs the extraction."""
     global stored_brief
 
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -314,9 +499,15 @@ async def upload_brief(file: UploadFile = File(None), text: str = Form(None)):
     else:
         return {"status": "error", "message": "No valid input received."}
 
-    # Run brief to graph
+    # Run brief to graph (or reuse the cached graph of the same brief)
+    cache_key = brief_cache_key(stored_brief, await lm_model_id())
+    graph = None if refresh else brief_cache_load(cache_key)
+    cached = graph is not None
     try:
-        graph = llm_extract_graph_from_brief(stored_brief)
+        if graph is None:
+            graph, served_by = await llm_extract_graph_from_brief(stored_brief)
+            # Store under the model that really answered, which may not be the one listed
+            brief_cache_store(brief_cache_key(stored_brief, served_by), graph, served_by)
     except Exception as e:
         return {
             "status": "ok",
@@ -339,6 +530,7 @@ async def upload_brief(file: UploadFile = File(None), text: str = Form(None)):
         "source": source_label,
         "chat_notice": f"Brief received ({source_label}: {original_name}). Graph ready — **{n} nodes**, **{e} edges**.",
         "graph_path": str(graph_json_path),
+        "cached": cached,
         "graph": graph
     }
 
@@ -392,8 +584,54 @@ def clean_graph_schema(data: dict) -> dict:
         elif not isinstance(mv, list): e["mode"] = []
     return data
 
+# === BRIEF GRAPH CACHE ===
+def normalize_brief(text: str) -> str:
+    """Text as far as the cache is concerned: NFKC, one space between words, no page-break noise."""
+    text = unicodedata.normalize("NFKC", text or "")
+    return " ".join(text.split())
+
+
+def brief_cache_key(brief_text: str, model: str | None) -> str | None:
+    """
+    Cache key for a brief extracted by model, or None when caching is off, there is
+    nothing to extract, or the model id is unknown.
+    """
+    norm = normalize_brief(brief_text)
+    if not BRIEF_CACHE or not norm or not model:
+        return None
+    blob = json.dumps({"prompt": BRIEF_PROMPT_VERSION, "model": model, "brief": norm},
+                      sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+def brief_cache_load(key: str | None) -> dict | None:
+    if not key:
+        return None
+    try:
+        with open(BRIEF_CACHE_DIR / f"{key}.json", "r", encoding="utf-8") as f:
+            return json.load(f)["graph"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def brief_cache_store(key: str | None, graph: dict, model: str | None):
+    if not key:
+        return
+    try:
+        BRIEF_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        path = BRIEF_CACHE_DIR / f"{key}.json"
+        tmp = path.with_suffix(f".tmp{os.getpid()}")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"prompt": BRIEF_PROMPT_VERSION, "model": model,
+                       "created": datetime.now().isoformat(timespec="seconds"), "graph": graph},
+                      f, ensure_ascii=False)
+        os.replace(tmp, path)
+    except OSError as e:
+        print("[brief_cache] Could not store graph:", e)
+
 # === BRIEF to GRAPH ===
-def llm_extract_graph_from_brief(brief_text: str) -> dict:
+async def llm_extract_graph_from_brief(brief_text: str) -> tuple:
+    """(graph, id of the model that produced it, as reported in the completion)."""
     system = (
         "You are an expert urban planner who converts briefs into program graphs. "
         "Return only valid JSON with keys 'nodes' and 'edges'."
@@ -409,7 +647,7 @@ Extract a buildable program graph.
 Brief:
 \"\"\"{brief_text}\"\"\""""
     payload = {
-        "model": "lmstudio",
+        "model": LM_MODEL,
         "messages": [{"role": "system", "content": system},
                      {"role": "user", "content": user}],
         "temperature": 0.2,
@@ -418,12 +656,254 @@ Brief:
         "stream": False,
         "stop": ["User:", "Assistant:", "System:"],
     }
-    r = requests.post(LM_STUDIO_URL, json=payload, timeout=60)
-    r.raise_for_status()
-    raw = r.json()["choices"][0]["message"]["content"]
+    r = await lm_chat(payload, timeout=60)
+    raw = r["choices"][0]["message"]["content"]
     txt = extract_first_json(raw) or raw
     data = json.loads(txt)
-    return clean_graph_schema(data)
+    return clean_graph_schema(data), r.get("model")
+
+# ============================
+# Job queue + warm worker pool (OSM and evaluation jobs)
+# ============================
+# Jobs wait in one FIFO queue and run on JOB_WORKERS long-lived job_worker.py processes
+# that import the geo stack once. An identical job that is still queued is not queued
+# twice. JOBS[job_id] holds the public status:
+#   queued -> running -> finished | failed, or cancelled at any point.
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "2"))
+JOB_QUEUE_MAX = int(os.environ.get("JOB_QUEUE_MAX", "16"))
+JOB_WORKER_MAX_JOBS = int(os.environ.get("JOB_WORKER_MAX_JOBS", "20"))  # recycle to cap memory growth
+JOB_WORKER_SCRIPT = BASE_DIR / "job_worker.py"
+
+
+def _first_line(path):
+    try:
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            return f.readline().strip() or None
+    except OSError:
+        return None
+
+
+class _WarmWorker:
+    """One job_worker.py process; run() blocks until its job ends or the process dies."""
+
+    def __init__(self):
+        self.proc = subprocess.Popen(
+            [_python_exe(), "-u", str(JOB_WORKER_SCRIPT)], cwd=str(PROJECT_DIR),
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True, encoding="utf-8", bufsize=1,
+        )
+        self.jobs_run = 0
+        self.ready = self._read() is not None
+
+    def _read(self):
+        line = self.proc.stdout.readline()
+        return json.loads(line) if line else None
+
+    def run(self, job_id, script, env):
+        """{"ok", "error"} for the job, or None if the process died (killed or crashed)."""
+        self.jobs_run += 1
+        try:
+            self.proc.stdin.write(json.dumps({"id": job_id, "script": script, "env": env}) + "\n")
+            self.proc.stdin.flush()
+            return self._read()
+        except (OSError, ValueError):
+            return None
+
+    def alive(self):
+        return self.proc.poll() is None
+
+    def kill(self, wait=True):
+        try:
+            self.proc.kill()
+            if wait:
+                self.proc.wait(timeout=10)
+        except Exception:
+            pass
+
+
+class JobManager:
+    def __init__(self, workers=JOB_WORKERS, queue_max=JOB_QUEUE_MAX):
+        self.size = max(1, workers)
+        self.queue_max = queue_max
+        self._pending = deque()          # job dicts, FIFO
+        self._running: Dict[str, tuple] = {}  # job_id -> (job, _WarmWorker)
+        self._cv = threading.Condition(threading.RLock())
+        self._threads = []
+        self._stopping = False
+
+    def start(self):
+        for i in range(self.size):
+            t = threading.Thread(target=self._serve, name=f"job-worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def stop(self):
+        with self._cv:
+            self._stopping = True
+            for job in self._pending:
+                self._set(job, status="cancelled")
+            self._pending.clear()
+            running = []
+            for job, w in self._running.values():
+                job["cancelled"] = True
+                w.kill(wait=False)
+                running.append(w)
+            self._cv.notify_all()
+        for w in running:
+            w.kill()
+
+    def find(self, kind, key, running=False):
+        """Id of a queued (or, with running=True, running) job of this kind and key, else None."""
+        with self._cv:
+            jobs = list(self._pending) + ([j for j, _ in self._running.values()] if running else [])
+            for job in jobs:
+                if job["kind"] == kind and job["key"] == key and not job["cancelled"]:
+                    return job["id"]
+        return None
+
+    def submit(self, kind, key, script, env, fail_flag=None, job_id=None, **info):
+        """
+        Queue a job; returns (job_id, deduped). A queued job of the same kind and key is
+        reused instead of queueing a duplicate. Raises RuntimeError when the queue is full.
+        """
+        with self._cv:
+            same = self.find(kind, key)
+            if same is not None:
+                return same, True
+            if len(self._pending) >= self.queue_max:
+                raise RuntimeError(f"Job queue is full ({self.queue_max} waiting)")
+            job = {"id": job_id or str(uuid.uuid4()), "kind": kind, "key": key,
+                   "script": str(script), "env": env, "fail_flag": fail_flag, "cancelled": False}
+            JOBS[job["id"]] = {"kind": kind, "status": "queued",
+                               "queued_at": datetime.now().isoformat(timespec="seconds"), **info}
+            self._pending.append(job)
+            self._cv.notify()
+            return job["id"], False
+
+    def cancel(self, job_id):
+        """Cancel a queued or running job; False if it is neither."""
+        with self._cv:
+            for job in self._pending:
+                if job["id"] == job_id:
+                    self._pending.remove(job)
+                    self._set(job, status="cancelled")
+                    return True
+            entry = self._running.get(job_id)
+            if entry is None:
+                return False
+            job, worker = entry
+            job["cancelled"] = True
+            # Signal while holding the lock: the serving thread cannot have handed this
+            # worker its next job yet, so only the cancelled job dies
+            worker.kill(wait=False)
+        worker.kill()  # reap; the serving thread records the cancellation and spawns a fresh worker
+        return True
+
+    def cancel_kind(self, kind):
+        with self._cv:
+            ids = [j["id"] for j in self._pending if j["kind"] == kind]
+            ids += [jid for jid, (j, _) in self._running.items() if j["kind"] == kind]
+        for jid in ids:
+            self.cancel(jid)
+
+    def position(self, job_id):
+        """1-based place in the queue, or None if the job is not waiting."""
+        with self._cv:
+            for i, job in enumerate(self._pending):
+                if job["id"] == job_id:
+                    return i + 1
+        return None
+
+    def _set(self, job, **fields):
+        JOBS.setdefault(job["id"], {}).update(fields)
+
+    def _spawn(self):
+        while not self._stopping:
+            try:
+                w = _WarmWorker()
+                if w.ready:
+                    return w
+                w.kill()
+            except Exception as e:
+                print("[jobs] Could not start a worker:", e)
+            time.sleep(2.0)
+        return None
+
+    def _serve(self):
+        worker = self._spawn()
+        while worker is not None:
+            with self._cv:
+                while not self._pending and not self._stopping:
+                    self._cv.wait()
+                if self._stopping:
+                    break
+                job = self._pending.popleft()
+                self._running[job["id"]] = (job, worker)
+            t0 = time.time()
+            self._set(job, status="running", started_at=datetime.now().isoformat(timespec="seconds"),
+                      worker_pid=worker.proc.pid)
+            res = worker.run(job["id"], job["script"], job["env"])
+            with self._cv:
+                self._running.pop(job["id"], None)
+
+            fields = {"finished_at": datetime.now().isoformat(timespec="seconds"),
+                      "seconds": round(time.time() - t0, 3)}
+            if job["cancelled"]:
+                fields["status"] = "cancelled"
+            elif res is None:
+                fields.update(status="failed", error="worker process exited")
+            elif not res.get("ok"):
+                fields.update(status="failed", error=res.get("error"))
+            elif job["fail_flag"] and os.path.exists(job["fail_flag"]):
+                # the worker caught its own error and left a flag file behind
+                fields.update(status="failed", error=_first_line(job["fail_flag"]))
+            else:
+                fields["status"] = "finished"
+            self._set(job, **fields)
+
+            if res is None or not worker.alive() or worker.jobs_run >= JOB_WORKER_MAX_JOBS:
+                worker.kill()
+                worker = self._spawn()
+        if worker is not None:
+            worker.kill()
+
+
+JOB_MANAGER = JobManager()
+
+
+@app.on_event("startup")
+async def _start_job_manager():
+    JOB_MANAGER.start()  # workers warm up in the background
+
+
+@app.on_event("shutdown")
+async def _stop_job_manager():
+    await run_in_threadpool(JOB_MANAGER.stop)
+
+
+def _job_public(job_id):
+    info = dict(JOBS.get(job_id) or {})
+    if info.get("status") == "queued":
+        info["position"] = JOB_MANAGER.position(job_id)
+    return info
+
+
+@app.get("/jobs")
+async def list_jobs():
+    return {"ok": True, "jobs": {jid: _job_public(jid) for jid in list(JOBS)}}
+
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    if job_id not in JOBS:
+        return {"ok": False, "error": "unknown job"}
+    return {"ok": True, "job_id": job_id, **_job_public(job_id)}
+
+
+@app.post("/jobs/{job_id}/cancel")
+async def job_cancel(job_id: str):
+    ok = await run_in_threadpool(JOB_MANAGER.cancel, job_id)
+    return {"ok": ok, "job_id": job_id, "status": (JOBS.get(job_id) or {}).get("status")}
+
 
 # ============================
 # OSM endpoints (silent responses)
@@ -431,9 +911,9 @@ Brief:
 @app.post("/osm/run")
 async def osm_run(payload: dict):
     """
-    Launch OSM download worker (Python 3) as a background subprocess.
+    Queue an OSM download job on the worker pool.
     Expects: { "lat": float, "lon": float, "radius_km": float }
-    Returns: { ok, job_id }
+    Returns: { ok, job_id, resumed, deduped }
     """
     try:
         lat = float(payload.get("lat"))
@@ -442,12 +922,37 @@ async def osm_run(payload: dict):
     except Exception:
         return {"ok": False, "error": "Invalid lat/lon/radius_km"}
 
-    # NEW: remove previous workspace before creating the new one
-    _purge_previous_osm_workspace()
+    worker = PROJECT_DIR / "context" / "osm_worker.py"
+    if not worker.exists():
+        return {"ok": False, "error": f"Worker not found: {worker}"}
+
+    params = {"lat": lat, "lon": lon, "radius_km": radius_km}
+    key = json.dumps(params, sort_keys=True)
+    same = JOB_MANAGER.find("osm", key, running=True)
+    if same is not None:
+        # Identical request while the first one is still queued or running
+        return {"ok": True, "job_id": same, "resumed": False, "deduped": True}
+
+    resume_dir = _resumable_osm_job(params) if payload.get("resume", True) else None
+    if resume_dir is not None:
+        # Failed job with the same parameters: the worker resumes from its checkpoints
+        job_id = resume_dir.name
+        out_dir = resume_dir
+        try:
+            (out_dir / "FAILED.txt").unlink()
+        except Exception:
+            pass
+    else:
+        # One OSM workspace at a time: the new job supersedes queued/running ones,
+        # whose folders are about to be purged
+        await run_in_threadpool(JOB_MANAGER.cancel_kind, "osm")
+        # NEW: remove previous workspace before creating the new one
+        _purge_previous_osm_workspace()
 
-    job_id = str(uuid.uuid4())
-    out_dir = _job_dir(job_id)
-    os.makedirs(out_dir, exist_ok=True)
+        job_id = str(uuid.uuid4())
+        out_dir = _job_dir(job_id)
+        os.makedirs(out_dir, exist_ok=True)
+        _write_json(out_dir / "job.json", {"job_id": job_id, **params})
 
     # Record this as the last job to be purged on next run
     try:
@@ -455,27 +960,26 @@ async def osm_run(payload: dict):
     except Exception:
         pass
 
-    env = os.environ.copy()
-    env["LAT"] = str(lat)
-    env["LON"] = str(lon)
-    env["RADIUS_KM"] = str(radius_km)
-    env["OUT_DIR"] = str(out_dir)
-
-    worker = PROJECT_DIR / "context" / "osm_worker.py"
-    if not worker.exists():
-        return {"ok": False, "error": f"Worker not found: {worker}"}
+    env = {
+        "LAT": str(lat),
+        "LON": str(lon),
+        "RADIUS_KM": str(radius_km),
+        "OUT_DIR": str(out_dir),
+    }
 
     try:
-        subprocess.Popen([_python_exe(), str(worker)], cwd=str(PROJECT_DIR), env=env)
+        job_id, deduped = JOB_MANAGER.submit("osm", key, worker, env, fail_flag=str(out_dir / "FAILED.txt"),
+                                             job_id=job_id, out_dir=str(out_dir))
         # UI gets status via /osm/status
-        return {"ok": True, "job_id": job_id}
+        return {"ok": True, "job_id": job_id, "resumed": resume_dir is not None, "deduped": deduped}
     except Exception as e:
         return {"ok": False, "error": str(e)}
 
 @app.get("/osm/status/{job_id}")
 async def osm_status(job_id: str):
     """
-    Minimal status: running/finished/failed and the output folder.
+    Minimal status: running/finished/failed, the output folder and the per-stage
+    metrics the worker has written so far (job_metrics.json).
     Works after restarts using filesystem flags.
     """
     info = JOBS.get(job_id)
@@ -492,40 +996,240 @@ async def osm_status(job_id: str):
     failed_flag = os.path.join(out_dir, "FAILED.txt")
 
     status = info.get("status", "running")
-    if os.path.exists(failed_flag):
-        status = "failed"
-    elif os.path.exists(done_flag):
-        status = "finished"
+    if status not in ("queued", "cancelled"):
+        if os.path.exists(failed_flag):
+            status = "failed"
+        elif os.path.exists(done_flag):
+            status = "finished"
 
     info["status"] = status
-    return {"ok": True, "status": status, "out_dir": out_dir}
+    metrics = _read_json(Path(out_dir) / "job_metrics.json")
+    return {"ok": True, "status": status, "out_dir": out_dir, "metrics": metrics,
+            "position": JOB_MANAGER.position(job_id)}
 
 # ============================
-# MASSING graph endpoint
+# Change notifications: one watcher over knowledge/, pushed to clients as SSE
 # ============================
-@app.get("/graph/context")
-def get_context_graph():
-    path = KNOWLEDGE_DIR / "osm" / "graph_context.json"
-    if not path.exists():
-        return JSONResponse({"nodes": [], "edges": [], "meta": {}}, status_code=404)
-    with open(path, "r", encoding="utf-8") as f:
-        data = json.load(f)
-    links = data.get("links", data.get("edges", []))
+# event: change  data: {"artifact": <name>, "version": <signature hash>, "mtime": <epoch s>}
+# The version only changes when the artifact does, and is stable across server restarts,
+# so clients can tell a real change from the snapshot sent on (re)connect.
+try:
+    from watchfiles import awatch  # optional (ships with uvicorn[standard]); else stat polling
+except Exception:
+    awatch = None
+
+ARTIFACT_POLL_S = float(os.environ.get("ARTIFACT_POLL_S", "0.5"))     # fallback scan interval
+EVENTS_KEEPALIVE_S = float(os.environ.get("EVENTS_KEEPALIVE_S", "15"))
+JOB_FLAG_FILES = ("DONE.txt", "FAILED.txt", "evaluation.json")
+
+_artifacts: Dict[str, Dict] = {}        # name -> {"artifact", "version", "mtime"}
+_event_queues: set = set()
+_artifact_task = None
+
+
+def _artifact_files():
+    return {
+        "massing": [GRAPH_PATH],
+        "masterplan": [MASTERPLAN_PATH],
+        "enriched": [str(ENRICHED_FILE)],
+        "context": [str(OSM_DIR / "graph_context.json"), str(OSM_DIR / "graph_context.ugb")],
+        "ui_state": [str(UI_STATE_PATH)],
+    }
+
+
+def _osm_job_flags():
+    """Completion/evaluation flag files of every OSM job dir (what the Rhino listener acts on)."""
+    out = []
+    try:
+        with os.scandir(OSM_DIR) as it:
+            jobs = sorted(e.path for e in it if e.is_dir())
+    except OSError:
+        return out
+    for job in jobs:
+        out.extend(os.path.join(job, f) for f in JOB_FLAG_FILES)
+    return out
+
+
+def _scan_artifacts() -> Dict[str, Dict]:
+    """Current {name: event} of every watched artifact; missing files count as a state too."""
+    files = _artifact_files()
+    files["osm_jobs"] = _osm_job_flags()
+    out = {}
+    for name, paths in files.items():
+        sig, mtime = [], 0.0
+        for p in paths:
+            try:
+                st = os.stat(p)
+            except OSError:
+                continue
+            sig.append((p, st.st_mtime_ns, st.st_size))
+            mtime = max(mtime, st.st_mtime)
+        version = hashlib.sha1(repr(sig).encode("utf-8")).hexdigest()[:16]
+        out[name] = {"artifact": name, "version": version, "mtime": mtime}
+    return out
+
+
+def _publish(event: Dict):
+    for q in list(_event_queues):
+        try:
+            q.put_nowait(event)
+        except asyncio.QueueFull:  # client stopped reading; it will resync on reconnect
+            pass
+
+
+async def _refresh_artifacts():
+    current = await run_in_threadpool(_scan_artifacts)
+    changed = [ev for name, ev in current.items()
+               if _artifacts.get(name, {}).get("version") != ev["version"]]
+    _artifacts.update(current)
+    for ev in changed:
+        _publish(ev)
+        if ev["artifact"] == "massing":
+            await run_in_threadpool(_massing_context_text)  # pre-build the /chat context
+
+
+async def _artifact_watcher():
+    await _refresh_artifacts()
+    if awatch is not None:
+        try:
+            async for _ in awatch(str(KNOWLEDGE_DIR), debounce=100):
+                await _refresh_artifacts()
+        except Exception as e:
+            print("[events] File watcher failed, falling back to polling:", e)
+    while True:
+        await asyncio.sleep(ARTIFACT_POLL_S)
+        try:
+            await _refresh_artifacts()
+        except Exception as e:
+            print("[events] Artifact scan error:", e)
+
+
+@app.on_event("startup")
+async def _start_artifact_watcher():
+    global _artifact_task
+    _artifact_task = asyncio.create_task(_artifact_watcher())
+
+
+@app.on_event("shutdown")
+async def _stop_artifact_watcher():
+    if _artifact_task is not None:
+        _artifact_task.cancel()
+
+
+@app.get("/events")
+async def artifact_events(request: Request, artifacts: str = ""):
+    """
+    SSE stream of 'change' events. Starts with the current state of every artifact,
+    then sends one event per change; artifacts=a,b limits the stream to those names.
+    """
+    wanted = {a.strip() for a in artifacts.split(",") if a.strip()}
+    q: asyncio.Queue = asyncio.Queue(maxsize=256)
+    _event_queues.add(q)
+
+    async def stream():
+        try:
+            for ev in list(_artifacts.values()):
+                if not wanted or ev["artifact"] in wanted:
+                    yield _sse("change", ev)
+            while not await request.is_disconnected():
+                try:
+                    ev = await asyncio.wait_for(q.get(), timeout=EVENTS_KEEPALIVE_S)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                if not wanted or ev["artifact"] in wanted:
+                    yield _sse("change", ev)
+        finally:
+            _event_queues.discard(q)
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+# ============================
+# Graph responses: serialized once per file version, served with strong ETags
+# ============================
+_graph_cache: Dict[str, tuple] = {}   # path -> (signature, body bytes, etag)
+_graph_cache_lock = threading.Lock()
+
+
+def _file_signature(*paths):
+    """(mtime_ns, size) of every path (None for missing extras); None if the main file is missing."""
+    sig = []
+    for i, p in enumerate(paths):
+        try:
+            st = os.stat(p)
+        except OSError:
+            if i == 0:
+                return None
+            sig.append(None)
+            continue
+        sig.append((st.st_mtime_ns, st.st_size))
+    return tuple(sig)
+
+
+def _graph_payload(data: dict, **meta) -> dict:
+    """
+    Graph shape served on every /graph/* path, found or not; edges are sent once,
+    under 'links' (the UI adapters read 'edges' or 'links').
+    """
     return {
         "nodes": data.get("nodes", []),
-        "links": links,
-        "edges": links,
-        "meta": data.get("meta", {})
+        "links": data.get("links", data.get("edges", [])),
+        "meta": {**(data.get("meta", {}) or {}), **meta},
     }
 
 
+def _load_json(path) -> dict:
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _cached_graph_response(request: Request, path, load=_load_json, extra_paths=(), **meta):
+    """
+    Response for the graph file at path, or None if it does not exist. The JSON body is
+    built with load(path) once per (mtime, size) of path and extra_paths (e.g. the .ugb
+    companion) and reused; If-None-Match with the current ETag gets a bodyless 304.
+    """
+    path = str(path)
+    sig = _file_signature(path, *[str(p) for p in extra_paths])
+    if sig is None:
+        return None
+    with _graph_cache_lock:
+        hit = _graph_cache.get(path)
+    if hit is None or hit[0] != sig:
+        body = json.dumps(_graph_payload(load(path), **meta), ensure_ascii=False,
+                          separators=(",", ":")).encode("utf-8")
+        hit = (sig, body, '"{0}"'.format(hashlib.sha1(body).hexdigest()))
+        with _graph_cache_lock:
+            _graph_cache[path] = hit
+    _, body, etag = hit
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag in [t.strip() for t in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+# ============================
+# MASSING graph endpoint
+# ============================
+@app.get("/graph/context")
+def get_context_graph(request: Request):
+    path = KNOWLEDGE_DIR / "osm" / "graph_context.json"
+    res = _cached_graph_response(request, path, load_graph or _load_json, [path.with_suffix(".ugb")])
+    if res is None:
+        return JSONResponse(_graph_payload({}), status_code=404)
+    return res
+
+
 # ============================
 # EVALUATION endpoint
 # ============================
 @app.post("/evaluate/run")
 async def evaluate_run(payload: dict):
     """
-    Launch evaluation worker as a background subprocess.
+    Queue an evaluation job on the worker pool. Repeated triggers for a job_dir whose
+    evaluation is still waiting collapse into that one job.
     Expects: { "job_dir": "<absolute path to job folder>" }
     """
     try:
@@ -537,12 +1241,11 @@ async def evaluate_run(payload: dict):
         if not worker.exists():
             return {"ok": False, "error": f"Worker not found: {worker}"}
 
-        env = os.environ.copy()
-        env["JOB_DIR"] = str(job_dir)
-
-        subprocess.Popen([_python_exe(), str(worker)], cwd=str(PROJECT_DIR), env=env)
+        job_id, deduped = JOB_MANAGER.submit("evaluate", os.path.abspath(job_dir), worker,
+                                             {"JOB_DIR": str(job_dir)}, job_dir=job_dir)
 
-        return {"ok": True, "message": "Evaluation started.", "job_dir": job_dir}
+        return {"ok": True, "message": "Evaluation already queued." if deduped else "Evaluation queued.",
+                "job_id": job_id, "deduped": deduped, "job_dir": job_dir}
     except Exception as e:
         return {"ok": False, "error": str(e)}
 
@@ -589,22 +1292,12 @@ async def set_plot_preview(payload: dict):
 # ============================
 # Massing graph endpoints
 # ============================
-def _read_graph():
-    if not os.path.exists(GRAPH_PATH):
-        return {"nodes": [], "links": [], "edges": [], "meta": {}}
-    with open(GRAPH_PATH, "r") as f:
-        data = json.load(f)
-    links = data.get("links", data.get("edges", []))
-    return {
-        "nodes": data.get("nodes", []),
-        "links": links,
-        "edges": links,
-        "meta": data.get("meta", {})
-    }
-
 @app.get("/graph/massing")
-def get_massing_graph():
-    return JSONResponse(_read_graph())
+def get_massing_graph(request: Request):
+    res = _cached_graph_response(request, GRAPH_PATH)
+    if res is None:  # no massing yet is a valid, empty graph
+        return JSONResponse(_graph_payload({}))
+    return res
 
 @app.get("/graph/massing/mtime")
 def get_massing_mtime():
@@ -614,19 +1307,12 @@ def get_massing_mtime():
         return {"mtime": 0.0}
 
 @app.get("/graph/masterplan")
-def get_masterplan_graph():
+def get_masterplan_graph(request: Request):
     try:
-        if not os.path.exists(MASTERPLAN_PATH):
-                        return {"nodes": [], "links": [], "edges": [], "meta": {"missing": True}}
-        with open(MASTERPLAN_PATH, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        links = data.get("links", data.get("edges", []))
-        return {
-            "nodes": data.get("nodes", []),
-            "links": links,
-            "edges": links,
-            "meta": data.get("meta", {})
-        }
+        res = _cached_graph_response(request, MASTERPLAN_PATH)
+        if res is None:
+            return JSONResponse(_graph_payload({}, missing=True))
+        return res
     except Exception as e:
         return JSONResponse({"error": str(e)}, status_code=500)
 
@@ -638,16 +1324,46 @@ def get_masterplan_mtime():
         return {"mtime": 0.0}
 
 # ---- Massing context condenser ----
+# The summary is memoized per (mtime, size) of massing_graph.json and pre-built by the
+# change-notification watcher as soon as Rhino rewrites the file, so /chat usually only
+# pays for a stat().
+_massing_ctx = {"key": None, "text": ""}
+_massing_ctx_lock = threading.Lock()
+
+
+def _massing_signature():
+    try:
+        st = os.stat(GRAPH_PATH)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
 def _massing_context_text(max_nodes: int = 200, max_edges: int = 200, include_stats: bool = True) -> str:
+    """Cached _build_massing_context_text(); rebuilt only when massing_graph.json changes."""
+    sig = _massing_signature()
+    if sig is None:
+        return ""
+    key = (sig, max_nodes, max_edges, include_stats)
+    with _massing_ctx_lock:
+        if _massing_ctx["key"] == key:
+            return _massing_ctx["text"]
+        text = _build_massing_context_text(max_nodes, max_edges, include_stats)
+        if text is not None:  # unreadable (e.g. mid-write) is retried on the next call
+            _massing_ctx.update(key=key, text=text)
+        return text or ""
+
+
+def _build_massing_context_text(max_nodes: int = 200, max_edges: int = 200, include_stats: bool = True) -> str | None:
     """
     Returns a concise, LLM-friendly text summary of the massing graph, aligned to the actual schema.
-    Truncates to avoid blowing the token budget.
+    Truncates to avoid blowing the token budget. None if the file cannot be read.
     """
     try:
         with open(GRAPH_PATH, "r", encoding="utf-8") as f:
             data = json.load(f)
     except Exception:
-        return ""
+        return None
 
     nodes = data.get("nodes", []) or []
     edges = data.get("links", data.get("edges", [])) or []
@@ -735,21 +1451,12 @@ def _massing_context_text(max_nodes: int = 200, max_edges: int = 200, include_st
     return "\n".join(summary)
 
 @app.get("/graph/enriched/latest")
-def get_enriched_latest():
+def get_enriched_latest(request: Request):
     """Serve a single fixed enriched graph file."""
-    if not ENRICHED_FILE.exists():
-        return JSONResponse({"nodes": [], "edges": [], "meta": {}}, status_code=404)
-
-    with open(ENRICHED_FILE, "r", encoding="utf-8") as f:
-        data = json.load(f)
-
-    links = data.get("links", data.get("edges", []))
-    return {
-        "nodes": data.get("nodes", []),
-        "links": links,
-        "edges": links,  # keep both keys for the frontend adapter
-        "meta": {**data.get("meta", {}), "iteration_file": ENRICHED_FILE.name}
-    }
+    res = _cached_graph_response(request, ENRICHED_FILE, iteration_file=ENRICHED_FILE.name)
+    if res is None:
+        return JSONResponse(_graph_payload({}), status_code=404)
+    return res
 
 @app.get("/graph/enriched/mtime")
 def get_enriched_mtime():
@@ -0,0 +1,85 @@
+# llm/test_job_manager.py
+# Cancelling a job that is just finishing must never kill the worker's next job.
+# Run with pytest from the project root (needs the server's dependencies).
+
+import os
+import sys
+import time
+import threading
+
+import pytest
+
+pytest.importorskip("fastapi")
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from llm import llm as server  # noqa: E402
+
+
+class FakeWorker:
+    """Stands in for _WarmWorker: run() blocks until the test releases the job or kill()."""
+
+    release = {}             # job_id -> threading.Event
+    kills = []               # job the worker was on when each kill signal landed
+    kill_started = threading.Event()
+
+    def __init__(self):
+        self.ready = True
+        self.jobs_run = 0
+        self.current = None
+        self.dead = threading.Event()
+        self.proc = type("Proc", (), {"pid": 0})()
+
+    def run(self, job_id, script, env):
+        self.jobs_run += 1
+        self.current = job_id
+        done = FakeWorker.release.setdefault(job_id, threading.Event())
+        while not done.is_set():
+            if self.dead.is_set():
+                return None
+            time.sleep(0.005)
+        return None if self.dead.is_set() else {"ok": True, "error": None}
+
+    def alive(self):
+        return not self.dead.is_set()
+
+    def kill(self, wait=True):
+        if self.dead.is_set():
+            return
+        FakeWorker.kill_started.set()
+        time.sleep(0.2)  # wide window for the serving thread to move on to the next job
+        FakeWorker.kills.append(self.current)
+        self.dead.set()
+
+
+def _wait_status(job_id, status, timeout=5.0):
+    t0 = time.time()
+    while time.time() - t0 < timeout:
+        if (server.JOBS.get(job_id) or {}).get("status") == status:
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_cancel_racing_with_completion_spares_next_job(monkeypatch):
+    monkeypatch.setattr(server, "_WarmWorker", FakeWorker)
+    jm = server.JobManager(workers=1, queue_max=4)
+    jm.start()
+    try:
+        a, _ = jm.submit("osm", "a", "a.py", {})
+        b, _ = jm.submit("osm", "b", "b.py", {})
+        assert _wait_status(a, "running")
+
+        canceller = threading.Thread(target=jm.cancel, args=(a,))
+        canceller.start()
+        assert FakeWorker.kill_started.wait(5.0)
+        FakeWorker.release[a].set()  # job a finishes while its cancellation is in flight
+        canceller.join(5.0)
+
+        assert FakeWorker.kills == [a]
+        assert _wait_status(a, "cancelled")
+        assert _wait_status(b, "running")
+        FakeWorker.release.setdefault(b, threading.Event()).set()
+        assert _wait_status(b, "finished"), server.JOBS.get(b)
+    finally:
+        for ev in FakeWorker.release.values():
+            ev.set()
+        jm.stop()
@@ -11,6 +11,12 @@ import scriptcontext as sc
 
 from System.Drawing import Color
 
+# Binary graph companion reader (context/graph_binary.py, on sys.path via rhino_listener)
+try:
+    from graph_binary import load_graph
+except Exception:
+    load_graph = None
+
 # ---- node category colors ----
 CAT_COLORS = {
     "Residential": Color.FromArgb(220, 45, 70),
@@ -189,7 +195,7 @@ class EvaluationConduit(Rhino.Display.DisplayConduit):
                 Rhino.RhinoApp.WriteLine("[evaluation_preview] graph.json not found at: {0}".format(gpath))
                 return
 
-            g = json.load(open(gpath, "r"))
+            g = load_graph(gpath) if load_graph is not None else json.load(open(gpath, "r"))
             nodes = g.get("nodes", [])
             edges = g.get("edges", [])
 
@@ -10,6 +10,12 @@ import scriptcontext as sc
 import rhinoscriptsyntax as rs
 import System.Drawing as sd
 
+# Binary graph companion reader (context/graph_binary.py, on sys.path via rhino_listener)
+try:
+    from graph_binary import load_graph
+except Exception:
+    load_graph = None
+
 # --- Try to import the categorization + colors from evaluation_preview.py ---
 try:
     from evaluation_preview import categorize_node, CAT_COLORS
@@ -104,8 +110,11 @@ class GraphPreviewConduit(Rhino.Display.DisplayConduit):
             self.nodes = []
             self.edges = []
             return
-        with open(self.path, "r") as f:
-            data = json.load(f)
+        if load_graph is not None:
+            data = load_graph(self.path)
+        else:
+            with open(self.path, "r") as f:
+                data = json.load(f)
         self.nodes = data.get("nodes", [])
         self.edges = data.get("edges", [])
 
@@ -41,6 +41,16 @@ STICKY_MASSING_DIRTY = "massing_dirty"
 
 WATCHER_STARTED_AT = None  # epoch seconds to ignore old DONE.txt
 
+# Change notifications from the backend (llm.py /events); the watcher wakes on them
+# and only falls back to polling while the stream is unavailable.
+EVENTS_URL = "http://127.0.0.1:8000/events?artifacts=osm_jobs,ui_state"
+WATCH_FALLBACK_SECONDS = 3.0   # poll interval without the event stream
+WATCH_SAFETY_SECONDS = 60.0    # re-check interval even while connected
+EVENTS_READ_TIMEOUT_MS = 45000 # server pings every 15 s; longer silence = dead stream
+
+_watch_wake = threading.Event()
+_events_connected = False
+
 # ---- Paths (project structure aware) ----
 THIS_DIR = os.path.dirname(__file__)
 PROJECT_DIR = os.path.dirname(THIS_DIR)
@@ -1067,6 +1077,43 @@ def _try_import_finished_job():
         _import_job_on_ui(job_dir, job_id, imported)
         break
 
+def _events_loop():
+    """Read the backend's SSE stream; every change event wakes the watcher."""
+    global _events_connected
+    from System.Net import WebRequest
+    from System.IO import StreamReader
+    from System.Text import UTF8Encoding
+    while listener_active:
+        resp = None
+        try:
+            req = WebRequest.Create(EVENTS_URL)
+            req.Timeout = 5000
+            req.ReadWriteTimeout = EVENTS_READ_TIMEOUT_MS
+            resp = req.GetResponse()
+            reader = StreamReader(resp.GetResponseStream(), UTF8Encoding(False))
+            _events_connected = True
+            Rhino.RhinoApp.WriteLine("[rhino_listener] Listening for backend change events.")
+            while listener_active:
+                line = reader.ReadLine()
+                if line is None:
+                    break
+                if line.startswith("data:"):
+                    _watch_wake.set()
+        except Exception:
+            pass
+        finally:
+            if _events_connected:
+                Rhino.RhinoApp.WriteLine("[rhino_listener] Event stream lost; polling every {0} s.".format(WATCH_FALLBACK_SECONDS))
+            _events_connected = False
+            try:
+                if resp is not None:
+                    resp.Close()
+            except:
+                pass
+            _watch_wake.set()
+        if listener_active:
+            time.sleep(WATCH_FALLBACK_SECONDS)
+
 def _watcher_loop():
     Rhino.RhinoApp.WriteLine("[rhino_listener] OSM watcher started. Folder: {0}".format(OSM_DIR))
     while listener_active:
@@ -1078,11 +1125,12 @@ def _watcher_loop():
             _apply_ui_preview_state_if_changed()
         except Exception as e:
             Rhino.RhinoApp.WriteLine("[rhino_listener] Watcher error: {0}".format(e))
-        time.sleep(3.0)
+        _watch_wake.wait(WATCH_SAFETY_SECONDS if _events_connected else WATCH_FALLBACK_SECONDS)
+        _watch_wake.clear()
     Rhino.RhinoApp.WriteLine("[rhino_listener] OSM watcher stopped.")
 
-def _start_watcher_thread():
-    t = threading.Thread(target=_watcher_loop)
+def _start_thread(target):
+    t = threading.Thread(target=target)
     try:
         t.setDaemon(True)
     except:
@@ -1090,6 +1138,10 @@ def _start_watcher_thread():
     t.start()
     return t
 
+def _start_watcher_thread():
+    _start_thread(_events_loop)
+    return _start_thread(_watcher_loop)
+
 # ===========================
 # Setup / teardown
 # ===========================
@@ -1155,6 +1207,7 @@ def remove_layer_listener():
 def shutdown_listener():
     global listener_active
     listener_active = False
+    _watch_wake.set()
     remove_layer_listener()
     Rhino.RhinoApp.WriteLine("[rhino_listener] Listener shut down.")
 
@@ -3,10 +3,55 @@
 const API_BASE = "http://localhost:8000";
 const CONTEXT_GRAPH_PATH     = `${API_BASE}/graph/context`;
 const MASSING_GRAPH_PATH     = `${API_BASE}/graph/massing`;
-const MASSING_MTIME_PATH     = `${API_BASE}/graph/massing/mtime`;
 const MASTERPLAN_GRAPH_PATH  = `${API_BASE}/graph/masterplan`;
-const MASTERPLAN_MTIME_PATH  = `${API_BASE}/graph/masterplan/mtime`;
 const ENRICHED_LATEST_PATH   = `${API_BASE}/graph/enriched/latest`;
+const EVENTS_PATH            = `${API_BASE}/events`;
+
+/** Change notifications: one EventSource for the page; handlers per artifact name.
+    A handler runs only when the artifact's version differs from the last one seen,
+    so the snapshot the server sends on every (re)connect does not trigger reloads. */
+const _artifactHandlers = new Map(); // artifact -> async fn(event)
+const _artifactVersions = new Map(); // artifact -> last version seen
+let _events = null;
+
+function onArtifactChange(artifact, handler) {
+  _artifactHandlers.set(artifact, handler);
+  if (_events) return;
+  _events = new EventSource(EVENTS_PATH);
+  _events.addEventListener("change", async (msg) => {
+    let ev;
+    try { ev = JSON.parse(msg.data); } catch { return; }
+    const seen = _artifactVersions.get(ev.artifact);
+    _artifactVersions.set(ev.artifact, ev.version);
+    if (seen === undefined || seen === ev.version) return;
+    const handler = _artifactHandlers.get(ev.artifact);
+    if (handler) {
+      try { await handler(ev); } catch (e) { console.warn(`[UI] ${ev.artifact} update failed:`, e); }
+    }
+  });
+}
+
+function offArtifactChange(artifact) {
+  _artifactHandlers.delete(artifact);
+}
+
+/** Conditional GET for graph endpoints: sends the last ETag, and on 304 returns the
+    JSON parsed last time instead of downloading it again. -> { status, ok, json } */
+const _graphEtags = new Map(); // url -> { etag, json }
+
+async function fetchGraphJson(url) {
+  const prev = _graphEtags.get(url);
+  const r = await fetch(url, {
+    cache: "no-store",
+    headers: prev ? { "If-None-Match": prev.etag } : {},
+  });
+  if (r.status === 304 && prev) return { status: 200, ok: true, json: prev.json, notModified: true };
+  if (!r.ok) return { status: r.status, ok: false, json: null };
+  const json = await r.json();
+  const etag = r.headers.get("ETag");
+  if (etag) _graphEtags.set(url, { etag, json });
+  return { status: r.status, ok: true, json, notModified: false };
+}
 
 /** Retry helper for JSON fetches with small backoff.
     Pass {allowEmpty:true} when an empty graph should NOT be treated as an error. */
@@ -14,9 +59,9 @@ async function fetchJsonWithRetry(url, attempts = 3, delayMs = 800, { allowEmpty
   let lastErr;
   for (let i = 0; i < attempts; i++) {
     try {
-      const r = await fetch(url, { cache: "no-store" });
+      const r = await fetchGraphJson(url);
       if (!r.ok) throw new Error(`HTTP ${r.status}`);
-      const j = await r.json();
+      const j = r.json;
 
       const maybeNodes = Array.isArray(j?.nodes) ? j.nodes : [];
       const maybeLinks = Array.isArray(j?.links) ? j.links
@@ -60,9 +105,6 @@ function adaptGraph(raw) {
 window.adaptGraph = adaptGraph;
 
 // -------- Massing --------
-let _massingPoll = null;
-let _massingLastMtime = 0;
-
 async function loadMassingGraphOnce() {
   try {
     // allowEmpty: true => an empty massing file is valid, not an error
@@ -77,44 +119,26 @@ async function loadMassingGraphOnce() {
   }
 }
 
-async function startMassingPolling() {
-  stopMassingPolling();
-  try {
-    const r0 = await fetch(MASSING_MTIME_PATH, { cache: "no-store" });
-    const j0 = await r0.json();
-    _massingLastMtime = j0?.mtime || 0;
-  } catch {}
-
-  _massingPoll = setInterval(async () => {
-    try {
-      const r = await fetch(MASSING_MTIME_PATH, { cache: "no-store" });
-      const { mtime } = await r.json();
-      if (mtime && mtime !== _massingLastMtime) {
-        _massingLastMtime = mtime;
-        await loadMassingGraphOnce();
-      }
-    } catch {
-      /* keep polling silently */
-    }
-  }, 2500);
+function startMassingUpdates() {
+  onArtifactChange("massing", loadMassingGraphOnce);
 }
 
-function stopMassingPolling() {
-  if (_massingPoll) { clearInterval(_massingPoll); _massingPoll = null; }
+function stopMassingUpdates() {
+  offArtifactChange("massing");
 }
 
 // -------- Context --------
 async function loadContextGraphOnce() {
   try {
     // Gracefully handle 404 (means you don’t have a context graph yet)
-    const r = await fetch(CONTEXT_GRAPH_PATH, { cache: "no-store" });
+    const r = await fetchGraphJson(CONTEXT_GRAPH_PATH);
     if (r.status === 404) {
       if (typeof window.clearGraph === "function") window.clearGraph();
       return;
     }
     if (!r.ok) throw new Error(`HTTP ${r.status}`);
 
-    const data = await r.json();
+    const data = r.json;
     const adapted = adaptGraph(data);
     if (typeof window.showGraph3DBackground === "function") {
       window.showGraph3DBackground(adapted);
@@ -126,7 +150,6 @@ async function loadContextGraphOnce() {
 }
 
 // -------- Enriched (latest only) --------
-let _enrichedPoll = null;
 let _enrichedLastTag = null;
 
 async function findLatestEnrichedCandidate() {
@@ -146,36 +169,31 @@ async function loadEnrichedGraphOnce() {
   _enrichedLastTag = cand.tag;
 }
 
-function stopEnrichedPolling() {
-  if (_enrichedPoll) { clearInterval(_enrichedPoll); _enrichedPoll = null; }
+function stopEnrichedUpdates() {
+  offArtifactChange("enriched");
 }
 
-async function startEnrichedPolling() {
-  stopEnrichedPolling();
+async function startEnrichedUpdates() {
+  stopEnrichedUpdates();
   try {
     await loadEnrichedGraphOnce();
   } catch (e) {
     console.warn("[UI] Could not fetch enriched graph:", e);
     if (typeof window.clearGraph === "function") window.clearGraph();
   }
-  _enrichedPoll = setInterval(async () => {
-    try {
-      const cand = await findLatestEnrichedCandidate();
-      if (cand.tag !== _enrichedLastTag) {
-        const adapted = adaptGraph(cand.data);
-        if (typeof window.showGraph3DBackground === "function") {
-          window.showGraph3DBackground(adapted);
-        }
-        _enrichedLastTag = cand.tag;
+  onArtifactChange("enriched", async () => {
+    const cand = await findLatestEnrichedCandidate();
+    if (cand.tag !== _enrichedLastTag) {
+      const adapted = adaptGraph(cand.data);
+      if (typeof window.showGraph3DBackground === "function") {
+        window.showGraph3DBackground(adapted);
       }
-    } catch { /* silent */ }
-  }, 3000);
+      _enrichedLastTag = cand.tag;
+    }
+  });
 }
 
 // -------- Masterplan --------
-let _mpPoll = null;
-let _mpLastMtime = 0;
-
 /** Load Masterplan graph once with retries. */
 async function loadMasterplanGraphOnce() {
   try {
@@ -190,33 +208,12 @@ async function loadMasterplanGraphOnce() {
   }
 }
 
-async function startMasterplanPolling() {
-  stopMasterplanPolling();
-  try {
-    const r0 = await fetch(MASTERPLAN_MTIME_PATH, { cache: "no-store" });
-    const j0 = await r0.json();
-    _mpLastMtime = j0?.mtime || 0;
-  } catch {}
-
-  _mpPoll = setInterval(async () => {
-    try {
-      const r = await fetch(MASTERPLAN_MTIME_PATH, { cache: "no-store" });
-      const { mtime } = await r.json();
-      if (mtime && mtime !== _mpLastMtime) {
-        _mpLastMtime = mtime;
-        await loadMasterplanGraphOnce();
-      }
-    } catch {
-      // keep polling silently
-    }
-  }, 2500);
+function startMasterplanUpdates() {
+  onArtifactChange("masterplan", loadMasterplanGraphOnce);
 }
 
-function stopMasterplanPolling() {
-  if (_mpPoll) {
-    clearInterval(_mpPoll);
-    _mpPoll = null;
-  }
+function stopMasterplanUpdates() {
+  offArtifactChange("masterplan");
 }
 
 // === Tab switching (visual) ===
@@ -233,17 +230,17 @@ document.querySelectorAll(".tab button").forEach(btn => {
     const tab = btn.dataset.tab;
 
     if (tab === "context") {
-      stopMassingPolling();
-      stopEnrichedPolling();
-      stopMasterplanPolling();
+      stopMassingUpdates();
+      stopEnrichedUpdates();
+      stopMasterplanUpdates();
       await loadContextGraphOnce();
       return;
     }
 
     if (tab === "brief") {
-      stopMassingPolling();
-      stopEnrichedPolling();
-      stopMasterplanPolling();
+      stopMassingUpdates();
+      stopEnrichedUpdates();
+      stopMasterplanUpdates();
       if (window._briefGraph && typeof window.showGraph3DBackground === "function") {
         window.showGraph3DBackground(window._briefGraph);
       } else if (typeof window.clearGraph === "function") {
@@ -253,32 +250,32 @@ document.querySelectorAll(".tab button").forEach(btn => {
     }
 
     if (tab === "massing") {
-      stopEnrichedPolling();
-      stopMasterplanPolling();
+      stopEnrichedUpdates();
+      stopMasterplanUpdates();
       await loadMassingGraphOnce();
-      startMassingPolling();
+      startMassingUpdates();
       return;
     }
 
     if (tab === "enriched") {
-      stopMassingPolling();
-      stopMasterplanPolling();
-      startEnrichedPolling();
+      stopMassingUpdates();
+      stopMasterplanUpdates();
+      startEnrichedUpdates();
       return;
     }
 
     if (tab === "masterplan") {
-      stopMassingPolling();
-      stopEnrichedPolling();
+      stopMassingUpdates();
+      stopEnrichedUpdates();
       await loadMasterplanGraphOnce();
-      startMasterplanPolling();
+      startMasterplanUpdates();
       return;
     }
 
-    // default: clear + stop all pollers
-    stopMassingPolling();
-    stopEnrichedPolling();
-    stopMasterplanPolling();
+    // default: clear + stop all updates
+    stopMassingUpdates();
+    stopEnrichedUpdates();
+    stopMasterplanUpdates();
     if (typeof window.clearGraph === "function") window.clearGraph();
   });
 });
@@ -287,43 +284,44 @@ document.querySelectorAll(".tab button").forEach(btn => {
 document.addEventListener("DOMContentLoaded", async () => {
   const activeTab = document.querySelector('.tab button.active')?.dataset?.tab;
   if (activeTab === "massing") {
-    stopMasterplanPolling();
-    stopEnrichedPolling();
+    stopMasterplanUpdates();
+    stopEnrichedUpdates();
     await loadMassingGraphOnce();
-    startMassingPolling();
+    startMassingUpdates();
   } else if (activeTab === "context") {
-    stopMassingPolling();
-    stopEnrichedPolling();
-    stopMasterplanPolling();
+    stopMassingUpdates();
+    stopEnrichedUpdates();
+    stopMasterplanUpdates();
     await loadContextGraphOnce();
   } else if (activeTab === "masterplan") {
-    stopMassingPolling();
-    stopEnrichedPolling();
+    stopMassingUpdates();
+    stopEnrichedUpdates();
     await loadMasterplanGraphOnce();
-    startMasterplanPolling();
+    startMasterplanUpdates();
   } else if (activeTab === "brief") {
-    stopMassingPolling();
-    stopEnrichedPolling();
-    stopMasterplanPolling();
+    stopMassingUpdates();
+    stopEnrichedUpdates();
+    stopMasterplanUpdates();
     if (window._briefGraph && typeof window.showGraph3DBackground === "function") {
       window.showGraph3DBackground(window._briefGraph);
     } else if (typeof window.clearGraph === "function") {
       window.clearGraph();
     }
   } else if (activeTab === "enriched") {
-    stopMassingPolling();
-    stopMasterplanPolling();
-    startEnrichedPolling();
+    stopMassingUpdates();
+    stopMasterplanUpdates();
+    startEnrichedUpdates();
   } else {
-    stopMassingPolling();
-    stopEnrichedPolling();
-    stopMasterplanPolling();
+    stopMassingUpdates();
+    stopEnrichedUpdates();
+    stopMasterplanUpdates();
     if (typeof window.clearGraph === "function") window.clearGraph();
   }
 });
 
 window.addEventListener("beforeunload", () => {
-  stopMassingPolling();
-  stopEnrichedPolling();
-  stopMasterplanPolling();
+  stopMassingUpdates();
+  stopEnrichedUpdates();
+  stopMasterplanUpdates();
+  if (_events) { _events.close(); _events = null; }
 });
@@ -31,6 +31,7 @@
     el.innerHTML = html;
     chat.appendChild(el);
     if (chat.parentElement) chat.parentElement.scrollTop = chat.parentElement.scrollHeight;
+    return el;
   }
 
   // Legacy: uses #chat-history .history-content and strips outer <p>
@@ -46,6 +47,7 @@
     );
     box.appendChild(el);
     box.scrollTop = box.scrollHeight;
+    return el;
   }
 
   // Dispatcher: prefer legacy when .history-content exists
@@ -54,6 +56,17 @@
     return legacy ? appendMessageLegacy(role, content) : appendMessageMain(role, content);
   }
 
+  // Re-render a message element in place (used while a reply streams in)
+  function updateMessage(el, content) {
+    if (!el) return;
+    const legacy = el.classList.contains("msg");
+    let html = marked.parse(content);
+    if (legacy) html = html.replace(/^<p>|<\/p>$/g, "");
+    el.innerHTML = DOMPurify.sanitize(html);
+    const scroller = legacy ? el.parentElement : el.parentElement?.parentElement;
+    if (scroller) scroller.scrollTop = scroller.scrollHeight;
+  }
+
   function setStatus(text) {
     const s = document.getElementById("status");
     if (s) s.textContent = text || "";
@@ -144,7 +157,9 @@
       uploadPill.classList.toggle("empty", isEmpty);
     };
 
-    uploadPill.addEventListener("click", () => fileInput.click());
+    // Shift+click re-runs the extraction instead of reusing the server's cached graph
+    let refreshNext = false;
+    uploadPill.addEventListener("click", (e) => { refreshNext = e.shiftKey; fileInput.click(); });
     uploadPill.addEventListener("keydown", (e) => {
       if (e.key === "Enter" || e.key === " ") { e.preventDefault(); fileInput.click(); }
     });
@@ -163,6 +178,8 @@
 
       const formData = new FormData();
       formData.append("file", file);
+      if (refreshNext) formData.append("refresh", "true");
+      refreshNext = false;
 
       // UX: immediate feedback
       appendMessage("assistant", "Reading brief… extracting entities… building graph.");
@@ -322,6 +339,13 @@
               } else if (st.status === "failed") {
                 clearInterval(intv);
                 setStatus("OSM job failed. See FAILED.txt");
+              } else if (st.status === "cancelled") {
+                clearInterval(intv);
+                setStatus("OSM job cancelled.");
+              } else if (st.status === "queued") {
+                setStatus("OSM job queued" + (st.position ? " (#" + st.position + ")" : "") + "…");
+              } else {
+                setStatus("OSM job running…");
               }
             }).catch(function (err) {
               clearInterval(intv);
@@ -538,6 +562,29 @@
   };
 
   /* ---------------- Chat send ---------------- */
+  // Reads the /chat/stream SSE body; calls onEvent(event, data) per message.
+  async function readEventStream(res, onEvent) {
+    const reader = res.body.getReader();
+    const decoder = new TextDecoder();
+    let buf = "";
+    for (;;) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buf += decoder.decode(value, { stream: true });
+      let sep;
+      while ((sep = buf.indexOf("\n\n")) >= 0) {
+        const block = buf.slice(0, sep);
+        buf = buf.slice(sep + 2);
+        let event = "message", data = "";
+        for (const line of block.split("\n")) {
+          if (line.startsWith("event:")) event = line.slice(6).trim();
+          else if (line.startsWith("data:")) data += line.slice(5).trim();
+        }
+        if (data) onEvent(event, JSON.parse(data));
+      }
+    }
+  }
+
   async function sendMessage() {
     const input = document.getElementById("chat-input");
     const text = (input?.value || "").trim();
@@ -546,34 +593,43 @@
     appendMessage("user", text);
     if (input) input.value = "";
 
-    // typing indicator placeholder (legacy UI)
-    const hasLegacyBox = !!document.querySelector("#chat-history .history-content");
-    let placeholder = null;
-    if (hasLegacyBox) {
-      const box = document.querySelector("#chat-history .history-content");
-      placeholder = document.createElement("div");
-      placeholder.className = "msg assistant";
-      placeholder.textContent = "…";
-      box.appendChild(placeholder);
-      box.scrollTop = box.scrollHeight;
-    } else {
-      appendMessage("assistant", "…");
-    }
+    // typing indicator; the streamed reply is rendered into the same element
+    const bubble = appendMessage("assistant", "…");
+    let reply = "";
 
     try {
-      const res = await fetch(`${API}/chat`, {
+      const res = await fetch(`${API}/chat/stream`, {
         method: "POST",
         headers: { "Content-Type": "application/json" },
         body: JSON.stringify({ message: text }),
       });
-      const json = await res.json();
 
-      if (placeholder?.parentElement) placeholder.parentElement.removeChild(placeholder);
-      appendMessage("assistant", json.response || "No reply.");
+      if (!res.ok || !res.body) {
+        // Older server without streaming: fall back to the one-shot endpoint
+        const json = await fetch(`${API}/chat`, {
+          method: "POST",
+          headers: { "Content-Type": "application/json" },
+          body: JSON.stringify({ message: text }),
+        }).then((r) => r.json());
+        updateMessage(bubble, json.response || "No reply.");
+        return;
+      }
+
+      await readEventStream(res, (event, data) => {
+        if (event === "token") {
+          reply += data.delta || "";
+          updateMessage(bubble, reply);
+        } else if (event === "done") {
+          reply = data.response || reply;
+          updateMessage(bubble, reply || "No reply.");
+        } else if (event === "error") {
+          console.error(data.error);
+          updateMessage(bubble, reply || data.response || "Error contacting the assistant.");
+        }
+      });
     } catch (err) {
       console.error(err);
-      if (placeholder?.parentElement) placeholder.parentElement.removeChild(placeholder);
-      appendMessage("assistant", "Error contacting the assistant.");
+      updateMessage(bubble, reply || "Error contacting the assistant.");
     }
   }
 